@@ -4,6 +4,8 @@ from abc import ABC, abstractmethod
 class AbstractBroadcastModel(ABC):
     """A model that can be broadcasted to other nodes."""
 
+    # empty, so that subclasses can use __slots__
+    __slots__ = ()
     model_type = None
 
     def __init_subclass__(cls, **kwargs):
@@ -41,6 +43,8 @@ class AbstractBroadcastModel(ABC):
 class AbstractDatabaseModel(ABC):
     """A model that can be stored in the database."""
 
+    __slots__ = ()
+
     @property
     @abstractmethod
     def db_columns(self):
@@ -77,4 +81,4 @@ class AbstractDatabaseModel(ABC):
 
 class AbstractSanchainModel(AbstractBroadcastModel, AbstractDatabaseModel):
     """A model that can be broadcasted to other nodes and stored in the database."""
-    pass
+    __slots__ = ()
@@ -1,3 +1,4 @@
 # import client host and message handler
 from .client import Client
 from .message import MessageHandler
+from .pipeline import Pipeline
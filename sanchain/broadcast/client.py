@@ -1,38 +1,72 @@
 import websockets
 from ..models import Transaction, Block
+from .inventory import ExpiringCache, INV, identify, object_id, getdata, parse_control
 from .message import MessageHandler as MH
+from .pipeline import Pipeline
 
 
 class Client:
-    def __init__(self, host: str, port: int) -> None:
+    def __init__(self, host: str, port: int, wire_format: str = 'json', expiry: float = 600) -> None:
         self.host = host
         self.port = port
-        self.mh = MH()
+        self.mh = MH(wire_format)
+        # inventory ids of objects this client has sent or received
+        self.seen = ExpiringCache(expiry)
+        self.requested = ExpiringCache(expiry=30)
 
     async def connect(self):
         uri = f'ws://{self.host}:{self.port}'
         self.connection = await websockets.connect(uri)
 
-    async def send(self, message: str):
+    async def send(self, message: str | bytes):
         await self.connection.send(message)
 
-    async def listen_and_record(self):
+    async def broadcast(self, obj: Transaction | Block):
+        """
+        Sends a transaction or block in the wire format of this client.
+        The host announces it to the other clients, which request it if they
+        don't have it yet.
+        """
+        self.seen.add(object_id(obj))
+        await self.send(self.mh.convert(obj))
+
+    async def request_missing(self, ids: list[str]):
+        """Requests the announced objects that this client hasn't seen."""
+        missing = [id for id in ids if id not in self.seen and id not in self.requested]
+        for id in missing:
+            self.requested.add(id)
+        if missing:
+            await self.send(getdata(missing))
+
+    async def listen_and_record(self, pipeline: Pipeline | None = None):
         """
         Listen for messages and record them.
+        Each object message is decoded once, to find its inventory id, and
+        new objects are handed to the pipeline, which verifies and records
+        them off the socket loop. Without a pipeline, objects are only printed.
         """
-        async for message in self.connection:
-            if self.mh.validate_message(message):
-                obj = self.mh.revert(message)
-                if isinstance(obj, Transaction):
-                    print("Transaction received.")
-                    print(obj)
-                elif isinstance(obj, Block):
-                    print("Block received.")
-                    print(obj)
-
-                else:
-                    print("Invalid message received.")
-                    print(obj)
+        own_pipeline = pipeline is None
+        if own_pipeline:
+            pipeline = Pipeline()
+            pipeline.start()
+        try:
+            async for message in self.connection:
+                control = parse_control(message)
+                if control is not None:
+                    kind, ids = control
+                    if kind == INV:
+                        await self.request_missing(ids)
+                    continue
+
+                id, obj = identify(message)
+                if id in self.seen:
+                    continue
+                self.seen.add(id)
+                # messages that are not objects are rejected by the pipeline
+                await pipeline.put(message if obj is None else obj)
+        finally:
+            if own_pipeline:
+                await pipeline.stop()
 
     async def disconnect(self):
         await self.connection.close()
@@ -0,0 +1,216 @@
+import struct
+
+from ..config import SanchainConfig
+from ..models import Block, BlockReward, Transaction, UTXO, keys
+
+
+MAGIC = b'SNC'
+VERSION = 1
+
+BLOCK = b'B'
+TRANSACTION = b'T'
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.parts = []
+
+    def pack(self, format: str, *values):
+        self.parts.append(struct.pack(format, *values))
+
+    def bytes(self, value: bytes):
+        """Length prefixed bytes."""
+        self.parts.append(struct.pack('<I', len(value)))
+        self.parts.append(bytes(value))
+
+    def getvalue(self):
+        return b''.join(self.parts)
+
+
+class Reader:
+    """Reads a message front to back. A read past its end raises
+    ValueError, so that truncated messages are rejected."""
+
+    def __init__(self, data: bytes) -> None:
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def __advance(self, size: int):
+        if self.offset + size > len(self.data):
+            raise ValueError(f"Truncated message: {size} bytes needed at offset "
+                             f"{self.offset} of {len(self.data)}")
+        start, self.offset = self.offset, self.offset + size
+        return start
+
+    def unpack(self, format: str):
+        return struct.unpack_from(format, self.data, self.__advance(struct.calcsize(format)))
+
+    def bytes(self):
+        length, = self.unpack('<I')
+        start = self.__advance(length)
+        return bytes(self.data[start:self.offset])
+
+    def end(self):
+        if self.offset != len(self.data):
+            raise ValueError(f"{len(self.data) - self.offset} unexpected bytes at the end of the message")
+
+
+class BinaryCodec:
+    """
+    Versioned binary encoding of Block and Transaction messages.
+    Numbers are struct packed, bytes are length prefixed and public keys are
+    written once per message as DER in a key table and referenced by index.
+
+    Layout: MAGIC, version, kind, key table, then the block or transaction.
+    """
+
+    # uid, value, idx, block_index, spender_transaction_uid
+    utxo_format = '<qdqqq'
+    # uid, reward flag, sender key, receiver key, amount, block_index
+    transaction_format = '<qBHHdq'
+    # version, difficulty, reward, block_UTXO_usage_limit, miner_fees,
+    # block_height_limit, last_block_index, circulation
+    config_format = '<qqdqdqqd'
+    # idx, timestamp, nonce
+    block_format = '<qqq'
+
+    @classmethod
+    def is_binary(cls, message):
+        return isinstance(message, (bytes, bytearray)) and message[:len(MAGIC)] == MAGIC
+
+    @classmethod
+    def encode_transaction(cls, transaction: Transaction):
+        return cls.__encode(TRANSACTION, [transaction], cls.__write_transaction, transaction)
+
+    @classmethod
+    def encode_block(cls, block: Block):
+        return cls.__encode(BLOCK, block.transactions, cls.__write_block, block)
+
+    @classmethod
+    def decode(cls, message: bytes) -> Transaction | Block:
+        reader = Reader(message)
+        magic, version, kind = reader.unpack('<3sBc')
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported message version {version}")
+
+        key_count, = reader.unpack('<H')
+        key_table = []
+        for _ in range(key_count):
+            der = reader.bytes()
+            try:
+                key_table.append(keys.from_der(der))
+            except Exception as e:  # the DER parser raises its own errors
+                raise ValueError(f"Invalid key in the key table: {e!r}") from e
+
+        if kind == TRANSACTION:
+            obj = cls.__read_transaction(reader, key_table)
+        elif kind == BLOCK:
+            obj = cls.__read_block(reader, key_table)
+        else:
+            raise ValueError(f"Unknown message kind {kind}")
+        reader.end()
+        return obj
+
+    @classmethod
+    def __encode(cls, kind: bytes, transactions: list[Transaction], write, obj):
+        key_table = {}  # public key -> index in the key table
+        for transaction in transactions:
+            key_table.setdefault(transaction.sender, len(key_table))
+            key_table.setdefault(transaction.receiver, len(key_table))
+
+        writer = Writer()
+        writer.pack('<3sBc', MAGIC, VERSION, kind)
+        writer.pack('<H', len(key_table))
+        for key in key_table:
+            writer.bytes(keys.der(key))
+        write(writer, obj, key_table)
+        return writer.getvalue()
+
+    @classmethod
+    def __write_utxos(cls, writer: Writer, utxos: list[UTXO]):
+        writer.pack('<I', len(utxos))
+        for utxo in utxos:
+            writer.pack(cls.utxo_format, utxo.uid, utxo.value, utxo.idx,
+                        utxo.block_index, utxo.spender_transaction_uid)
+            writer.bytes(utxo.verification_key)
+            writer.bytes(utxo.transaction_hash)
+
+    @classmethod
+    def __read_utxos(cls, reader: Reader):
+        utxos = []
+        count, = reader.unpack('<I')
+        for _ in range(count):
+            uid, value, idx, block_index, spender = reader.unpack(cls.utxo_format)
+            verification_key = reader.bytes()
+            transaction_hash = reader.bytes()
+            utxos.append(UTXO(uid, verification_key, value, idx,
+                              transaction_hash, block_index, spender))
+        return utxos
+
+    @classmethod
+    def __write_transaction(cls, writer: Writer, transaction: Transaction, keys: dict):
+        writer.pack(
+            cls.transaction_format,
+            transaction.uid,
+            isinstance(transaction, BlockReward),
+            keys[transaction.sender],
+            keys[transaction.receiver],
+            transaction.amount,
+            transaction.block_index,
+        )
+        writer.bytes(transaction.signature)
+        writer.bytes(transaction.hash)
+        cls.__write_utxos(writer, transaction.utxos)
+        cls.__write_utxos(writer, transaction.nascent_utxos)
+
+    @classmethod
+    def __read_transaction(cls, reader: Reader, keys: list):
+        uid, is_reward, sender, receiver, amount, block_index = reader.unpack(
+            cls.transaction_format)
+        if sender >= len(keys) or receiver >= len(keys):
+            raise ValueError("Key index out of the key table")
+        signature = reader.bytes()
+        hash = reader.bytes()
+        utxos = cls.__read_utxos(reader)
+        nascent_utxos = cls.__read_utxos(reader)
+        model = BlockReward if is_reward else Transaction
+        return model(uid, keys[sender], keys[receiver], amount, utxos,
+                     signature, nascent_utxos, hash, block_index)
+
+    @classmethod
+    def __write_block(cls, writer: Writer, block: Block, keys: dict):
+        config = block.config
+        writer.pack(cls.block_format, block.idx, block.timestamp, block.nonce)
+        writer.bytes(block.merkle_root)
+        writer.bytes(block.hash)
+        writer.pack(
+            cls.config_format,
+            config.version,
+            config.difficulty,
+            config.reward,
+            config.block_UTXO_usage_limit,
+            config.miner_fees,
+            config.block_height_limit,
+            config.last_block_index,
+            config.circulation,
+        )
+        writer.bytes(config.last_block_hash)
+        writer.pack('<I', len(block.transactions))
+        for transaction in block.transactions:
+            cls.__write_transaction(writer, transaction, keys)
+
+    @classmethod
+    def __read_block(cls, reader: Reader, keys: list):
+        idx, timestamp, nonce = reader.unpack(cls.block_format)
+        merkle_root = reader.bytes()
+        hash = reader.bytes()
+        (version, difficulty, reward, block_UTXO_usage_limit, miner_fees,
+         block_height_limit, last_block_index, circulation) = reader.unpack(cls.config_format)
+        last_block_hash = reader.bytes()
+        # the config of a block is not tied to a local core
+        config = SanchainConfig('', version, difficulty, reward, block_UTXO_usage_limit,
+                                miner_fees, block_height_limit, last_block_index,
+                                last_block_hash, circulation)
+        count, = reader.unpack('<I')
+        transactions = [cls.__read_transaction(reader, keys) for _ in range(count)]
+        return Block(idx, timestamp, merkle_root, config, transactions, hash, nonce)
@@ -1,28 +1,151 @@
 import asyncio
 import websockets
 
+from .inventory import ExpiringCache, INV, GETDATA, inventory_id, inv, getdata, parse_control
 
-clients = []
 
+class Peer:
+    """A connected client and the bounded queue of messages it has yet to receive."""
 
-async def server(websocket, path):
-    clients.append(websocket)
-    print(f"{websocket.remote_address} connected.")
-    try:
-        async for message in websocket:
-            for client in clients:
-                await client.send(message)
-    except websockets.ConnectionClosed:
-        print(f"{websocket.remote_address} disconnected.")
+    def __init__(self, websocket, queue_size: int, expiry: float) -> None:
+        self.websocket = websocket
+        self.queue = asyncio.Queue(queue_size)
+        self.dropped = 0
+        self.writer: asyncio.Task | None = None
+        # inventory ids the client has sent, announced or been sent
+        self.known = ExpiringCache(expiry)
+        self.announcements = []  # ids to announce in the next inv
+
+    async def write(self):
+        """Sends the queued messages until the connection closes."""
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send(message)
+        except websockets.ConnectionClosed:
+            pass
+
+
+class Relay:
+    """
+    Relays blocks and transactions between clients with an inv/getdata
+    exchange: a new object is stored and announced to every other client by
+    its inventory id, and sent only to the clients that request it.
+    Objects smaller than `announce_size` bytes are sent to the clients at
+    once instead, an inv and a getdata would cost more than the object saves.
+    Objects that were seen within `expiry` seconds are not relayed again.
+
+    Every client is written to by its own task from a bounded queue, so a slow
+    client only delays itself. When its queue is full, the oldest queued
+    message is dropped (slow_peer_policy='drop') or the client is
+    disconnected (slow_peer_policy='disconnect').
+    """
+
+    def __init__(self, queue_size: int = 1024, slow_peer_policy: str = 'drop', expiry: float = 600,
+                 announce_size: int = 8 * 1024, verbose: bool = True) -> None:
+        assert slow_peer_policy in ('drop', 'disconnect')
+        self.queue_size = queue_size
+        self.announce_size = announce_size
+        self.slow_peer_policy = slow_peer_policy
+        self.expiry = expiry
+        self.verbose = verbose
+        self.peers = {}  # websocket -> Peer
+        self.objects = ExpiringCache(expiry)  # inventory id -> message
+        self.requested = ExpiringCache(expiry=30)  # ids asked for with getdata
+
+    async def handler(self, websocket, path=None):
+        peer = Peer(websocket, self.queue_size, self.expiry)
+        peer.writer = asyncio.create_task(peer.write())
+        # a client that disconnects while being written to is dropped at once
+        peer.writer.add_done_callback(lambda _: self.peers.pop(websocket, None))
+        self.peers[websocket] = peer
+        if self.verbose:
+            print(f"{websocket.remote_address} connected.")
+        try:
+            async for message in websocket:
+                self.receive(peer, message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.verbose:
+                print(f"{websocket.remote_address} disconnected.")
+            self.peers.pop(websocket, None)
+            peer.writer.cancel()
+
+    def receive(self, peer: Peer, message: str | bytes):
+        control = parse_control(message)
+        if control is None:
+            id = inventory_id(message)
+            peer.known.add(id)
+            if id in self.objects:
+                return  # duplicate
+            self.objects.add(id, message)
+            self.announce(id, message)
+            return
+
+        kind, ids = control
+        if kind == INV:
+            for id in ids:
+                peer.known.add(id)
+            missing = [id for id in ids
+                       if id not in self.objects and id not in self.requested]
+            for id in missing:
+                self.requested.add(id)
+            if missing:
+                self.send(peer, getdata(missing))
+
+        elif kind == GETDATA:
+            for id in ids:
+                message = self.objects.get(id)
+                if message is not None:
+                    peer.known.add(id)
+                    self.send(peer, message)
+
+    def announce(self, id: str, message: str | bytes):
+        """
+        Announces an object to every client that doesn't know it yet, or
+        sends it if it is smaller than `announce_size`. The ids announced
+        during one pass of the event loop are sent to a client in a single inv.
+        """
+        for peer in list(self.peers.values()):
+            if id not in peer.known:
+                peer.known.add(id)
+                if len(message) < self.announce_size:
+                    self.send(peer, message)
+                    continue
+                if not peer.announcements:
+                    asyncio.get_running_loop().call_soon(self.flush_announcements, peer)
+                peer.announcements.append(id)
+
+    def flush_announcements(self, peer: Peer):
+        ids, peer.announcements = peer.announcements, []
+        if ids:
+            self.send(peer, inv(ids))
+
+    def send(self, peer: Peer, message: str | bytes):
+        if peer.websocket not in self.peers:
+            return
+        try:
+            peer.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.slow_peer_policy == 'disconnect':
+                del self.peers[peer.websocket]
+                peer.writer.cancel()
+                asyncio.create_task(
+                    peer.websocket.close(code=1008, reason="Too slow"))
+            else:
+                peer.queue.get_nowait()
+                peer.queue.put_nowait(message)
+                peer.dropped += 1
+
+    async def serve(self, host: str, port: int):
+        async with websockets.serve(self.handler, host, port):
+            print(f"Server started at ws://{host}:{port}")
+            await asyncio.Future()  # run forever
 
-    finally:
-        clients.remove(websocket)
 
 if __name__ == "__main__":
     HOST = "localhost"
     PORT = 8765
 
-    start_server = websockets.serve(server, HOST, PORT)
-    print(f"Server started at ws://{HOST}:{PORT}")
-    asyncio.get_event_loop().run_until_complete(start_server)
-    asyncio.get_event_loop().run_forever()
+    asyncio.run(Relay().serve(HOST, PORT))
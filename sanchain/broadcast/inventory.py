@@ -0,0 +1,126 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from ..models import Block, Transaction
+from .message import MessageHandler as MH
+
+
+INV = 'inv'
+GETDATA = 'getdata'
+
+
+class ExpiringCache:
+    """Bounded mapping whose entries are forgotten `expiry` seconds after
+    they were added. Used as a seen-set when the values are not needed."""
+
+    def __init__(self, expiry: float = 600, maxsize: int = 100_000) -> None:
+        self.expiry = expiry
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (expires at, value), oldest first
+
+    def __purge(self):
+        now = time.monotonic()
+        while self.entries:
+            key, (expires, _) = next(iter(self.entries.items()))
+            if expires > now and len(self.entries) <= self.maxsize:
+                break
+            self.entries.popitem(last=False)
+
+    def add(self, key, value=None):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + self.expiry, value)
+        self.__purge()
+
+    def get(self, key, default=None):
+        self.__purge()
+        entry = self.entries.get(key)
+        return default if entry is None else entry[1]
+
+    def __contains__(self, key):
+        self.__purge()
+        return key in self.entries
+
+    def __len__(self):
+        self.__purge()
+        return len(self.entries)
+
+
+def __transaction_digest(transaction: Transaction):
+    # the signable digest is kept by the transaction, the other fields are
+    # empty until the transaction is mined
+    rest = json.dumps([
+        transaction.signature.hex(),
+        [utxo.spender_transaction_uid for utxo in transaction.utxos],
+        [utxo.to_json() for utxo in transaction.nascent_utxos],
+        transaction.hash.hex(),
+        transaction.block_index,
+    ]).encode()
+    return hashlib.sha256(b'T' + transaction.signable_digest() + rest).digest()
+
+
+def object_id(obj: Transaction | Block):
+    """Identifies an object by every field that is relayed, so that an
+    object has the same id in every wire format and a forged object can't
+    take the id of another one. A block is identified by its header, which
+    is hashed again rather than taken from the message, its config and its
+    transactions."""
+    if isinstance(obj, Block):
+        digest = hashlib.sha256(b'B' + obj.header().calculate_hash() + obj.hash
+                                + json.dumps(obj.config.to_json()).encode())
+        for transaction in obj.transactions:
+            digest.update(__transaction_digest(transaction))
+        return digest.hexdigest()
+    return __transaction_digest(obj).hex()
+
+
+def identify(message: str | bytes):
+    """Returns (inventory id, object) of an object message. Messages that
+    don't decode to an object are identified by the hash of their content,
+    with None as the object."""
+    try:
+        obj = MH.revert(message)
+    except Exception:
+        obj = None
+    if isinstance(obj, (Transaction, Block)):
+        return object_id(obj), obj
+    if isinstance(message, str):
+        message = message.encode()
+    return hashlib.sha256(message).hexdigest(), None
+
+
+def inventory_id(message: str | bytes):
+    return identify(message)[0]
+
+
+def inv(ids: list[str]):
+    """Announces objects without sending them."""
+    return json.dumps({'type': INV, 'items': ids})
+
+
+def getdata(ids: list[str]):
+    """Requests announced objects."""
+    return json.dumps({'type': GETDATA, 'items': ids})
+
+
+# control messages are recognised by their prefix, so that object messages
+# don't have to be parsed just to find out that they are not control messages
+__prefixes = {kind: json.dumps({'type': kind})[:-1] for kind in (INV, GETDATA)}
+
+
+def parse_control(message: str | bytes):
+    """Returns (type, ids) of an inv or getdata message, or None for objects.
+    Malformed control messages are returned as (type, [])."""
+    if not isinstance(message, str):
+        return None
+    for kind, prefix in __prefixes.items():
+        if message.startswith(prefix):
+            try:
+                ids = json.loads(message)['items']
+            except (json.JSONDecodeError, KeyError):
+                return kind, []
+            if not isinstance(ids, list) or not all(isinstance(id, str) for id in ids):
+                return kind, []
+            return kind, ids
+    return None
@@ -1,16 +1,32 @@
 import json
-from ..models import Transaction, Block
+from ..models import Transaction, Block, BlockReward
+from .codec import BinaryCodec
 
 
 class MessageHandler:
+    """
+    Converts models to messages and back.
+    Messages are JSON strings or, with wire_format='binary', BinaryCodec
+    bytes. Both are accepted when reverting, so nodes can switch formats
+    independently.
+    """
 
     types = {
-        'transaction': Transaction,
-        'block': Block,
+        Transaction.model_type: Transaction,
+        BlockReward.model_type: BlockReward,
+        Block.model_type: Block,
     }
+    formats = ('json', 'binary')
 
-    def validate_message(message: str) -> bool:
+    def __init__(self, wire_format: str = 'json') -> None:
+        assert wire_format in self.formats
+        self.wire_format = wire_format
+
+    @staticmethod
+    def validate_message(message: str | bytes) -> bool:
         """To be used on the client side."""
+        if BinaryCodec.is_binary(message):
+            return True
         try:
             message = json.loads(message)
             assert message['type'] in MessageHandler.types
@@ -19,14 +35,26 @@ class MessageHandler:
             return False
 
     @staticmethod
-    def convert_transaction(transaction: Transaction):
+    def convert_transaction(transaction: Transaction, wire_format: str = 'json'):
+        if wire_format == 'binary':
+            return BinaryCodec.encode_transaction(transaction)
         return json.dumps(transaction.to_json())
 
     @staticmethod
-    def convert_block(block: Block):
+    def convert_block(block: Block, wire_format: str = 'json'):
+        if wire_format == 'binary':
+            return BinaryCodec.encode_block(block)
         return json.dumps(block.to_json())
 
+    def convert(self, obj: Transaction | Block):
+        """Converts a model using the wire format of this handler."""
+        if isinstance(obj, Block):
+            return self.convert_block(obj, self.wire_format)
+        return self.convert_transaction(obj, self.wire_format)
+
     @staticmethod
-    def revert(message: str) -> Transaction | Block:
+    def revert(message: str | bytes) -> Transaction | Block:
+        if BinaryCodec.is_binary(message):
+            return BinaryCodec.decode(message)
         message = json.loads(message)
         return MessageHandler.types[message['type']].from_json(message)
@@ -0,0 +1,216 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+from ..core import SanchainCore
+from ..models import Block, BlockReward, Transaction
+from .message import MessageHandler as MH
+
+
+class StageMetrics:
+    """Counters of one pipeline stage and the depth of its input queue."""
+
+    def __init__(self, name: str, queue: asyncio.Queue) -> None:
+        self.name = name
+        self.queue = queue
+        self.processed = 0
+        self.rejected = 0
+        self.busy = 0.0  # seconds spent processing
+        self.max_depth = 0
+        self.started = time.perf_counter()
+
+    def record(self, processed: int, rejected: int, busy: float):
+        self.processed += processed
+        self.rejected += rejected
+        self.busy += busy
+
+    def observe(self):
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            'processed': self.processed,
+            'rejected': self.rejected,
+            'throughput': self.processed / elapsed if elapsed else 0.0,
+            'utilization': self.busy / elapsed if elapsed else 0.0,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+        }
+
+
+class Pipeline:
+    """
+    Staged processing of incoming messages, connected by bounded queues:
+
+    decode: each message is parsed once with MessageHandler.revert,
+        objects already decoded by the caller are passed on.
+    verify: transaction signatures are checked in batches with
+        Transaction.verify_many, off the event loop. The signatures in a
+        block are checked here as well, which fills the signature cache for
+        the block validation in the next stage.
+    apply: blocks are validated against the chain and added with
+        SanchainCore.receive_block, the verified transactions queued in
+        between are added to the mempool in batches with
+        Mempool.add_transactions, in arrival order.
+
+    When a stage falls behind, its queue fills up and put() waits, so the
+    socket is not read faster than messages can be processed.
+    Without a core, objects are only printed at the apply stage.
+
+    The stage threads run Python code (the RSA checks, the mempool) that
+    holds the GIL, which the event loop can wait for up to the switch
+    interval per thread. Without a process pool, signatures are checked
+    `slice_size` at a time and the GIL is released in between, and at most
+    `batch_size` objects are applied at once.
+    """
+
+    def __init__(self, core: SanchainCore | None = None, executor: Executor | None = None,
+                 queue_size: int = 256, batch_size: int = 16, slice_size: int = 4,
+                 verbose: bool = True) -> None:
+        self.core = core
+        self.executor = executor  # for signature checks, e.g. a ProcessPoolExecutor
+        self.batch_size = batch_size
+        self.slice_size = slice_size
+        self.verbose = verbose
+        # verification and the database are kept off the event loop
+        self.verifier = ThreadPoolExecutor(1, thread_name_prefix='verify')
+        self.applier = ThreadPoolExecutor(1, thread_name_prefix='apply')
+
+        self.decoded = asyncio.Queue(queue_size)
+        self.verified = asyncio.Queue(queue_size)
+        self.incoming = asyncio.Queue(queue_size)
+        self.metrics = {
+            'decode': StageMetrics('decode', self.incoming),
+            'verify': StageMetrics('verify', self.decoded),
+            'apply': StageMetrics('apply', self.verified),
+        }
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.__decode()),
+            asyncio.create_task(self.__verify()),
+            asyncio.create_task(self.__apply()),
+        ]
+
+    async def put(self, message: str | bytes | Transaction | Block):
+        """Queues a message or decoded object, waiting while the pipeline is full."""
+        await self.incoming.put(message)
+        self.metrics['decode'].observe()
+
+    async def join(self):
+        """Waits until every queued message has been processed."""
+        await self.incoming.join()
+        await self.decoded.join()
+        await self.verified.join()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.verifier.shutdown(wait=True)
+        self.applier.shutdown(wait=True)
+
+    def stats(self):
+        return {name: metrics.stats() for name, metrics in self.metrics.items()}
+
+    async def __decode(self):
+        metrics = self.metrics['decode']
+        while True:
+            message = await self.incoming.get()
+            start = time.perf_counter()
+            try:
+                obj = message if isinstance(message, (Transaction, Block)) else MH.revert(message)
+            except Exception:
+                obj = None
+            if not isinstance(obj, (Transaction, Block)):
+                if self.verbose:
+                    print("Invalid message received.")
+                metrics.record(0, 1, time.perf_counter() - start)
+                self.incoming.task_done()
+                continue
+            metrics.record(1, 0, time.perf_counter() - start)
+            await self.decoded.put(obj)
+            self.metrics['verify'].observe()
+            self.incoming.task_done()
+            # get() doesn't suspend while messages are queued, let the socket be read
+            await asyncio.sleep(0)
+
+    def __take_batch(self, queue: asyncio.Queue, first):
+        """The first object and the transactions queued behind it."""
+        batch = [first]
+        while len(batch) < self.batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+            if isinstance(batch[-1], Block):
+                break
+        return batch
+
+    def __verify_slices(self, transactions: list[Transaction], config):
+        if self.executor is not None:
+            # the checks run in the worker processes, this thread only waits
+            return Transaction.verify_many(transactions, config, self.executor)
+        verdicts = []
+        for i in range(0, len(transactions), self.slice_size):
+            verdicts += Transaction.verify_many(transactions[i:i + self.slice_size], config)
+            time.sleep(0)  # lets the event loop take the GIL
+        return verdicts
+
+    def __check_signatures(self, batch: list):
+        """Returns a verdict for each transaction, None for blocks."""
+        config = self.core.config if self.core is not None else None
+        transactions = [obj for obj in batch if isinstance(obj, Transaction)]
+        verdicts = iter(self.__verify_slices(transactions, config)
+                        if transactions and config is not None else [True] * len(transactions))
+        for obj in batch:
+            if isinstance(obj, Block) and config is not None:
+                self.__verify_slices([t for t in obj.transactions if not isinstance(t, BlockReward)], config)
+        return [next(verdicts) if isinstance(obj, Transaction) else None for obj in batch]
+
+    async def __verify(self):
+        metrics = self.metrics['verify']
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self.__take_batch(self.decoded, await self.decoded.get())
+            start = time.perf_counter()
+            verdicts = await loop.run_in_executor(self.verifier, self.__check_signatures, batch)
+            metrics.record(
+                len(batch), verdicts.count(False), time.perf_counter() - start)
+            for obj, verdict in zip(batch, verdicts):
+                if verdict is not False:
+                    await self.verified.put(obj)
+                    await asyncio.sleep(0)
+                    self.metrics['apply'].observe()
+                elif self.verbose:
+                    print("Invalid transaction received.")
+                self.decoded.task_done()
+
+    def __accept(self, batch: list):
+        """Returns a verdict for each object. A block can only be the last."""
+        if self.core is None:
+            return [True] * len(batch)
+        transactions = [obj for obj in batch if isinstance(obj, Transaction)]
+        verdicts = self.core.mempool.add_transactions(transactions) if transactions else []
+        if isinstance(batch[-1], Block):
+            verdicts.append(self.core.receive_block(batch[-1], self.executor))
+        return verdicts
+
+    async def __apply(self):
+        metrics = self.metrics['apply']
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self.__take_batch(self.verified, await self.verified.get())
+            start = time.perf_counter()
+            try:
+                verdicts = await loop.run_in_executor(self.applier, self.__accept, batch)
+            except Exception as e:
+                if self.verbose:
+                    print(f"Could not apply {len(batch)} objects: {e}")
+                verdicts = [False] * len(batch)
+            metrics.record(verdicts.count(True), verdicts.count(False),
+                           time.perf_counter() - start)
+            for obj, accepted in zip(batch, verdicts):
+                if self.verbose and accepted:
+                    print(f"{'Block' if isinstance(obj, Block) else 'Transaction'} received.")
+                    print(obj)
+                self.verified.task_done()
@@ -0,0 +1,305 @@
+import asyncio
+import base64
+import json
+from concurrent.futures import Executor
+
+import websockets
+
+from ..core import SanchainCore
+from ..models import Block, BlockHeader
+from .message import MessageHandler as MH
+
+
+GETHEADERS = 'getheaders'
+HEADERS = 'headers'
+GETBLOCKS = 'getblocks'
+NOTFOUND = json.dumps({'type': 'notfound'})
+
+# blocks of a few hundred transactions exceed the default 1 MiB
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+
+class SyncError(Exception):
+    pass
+
+
+def header_to_json(header: BlockHeader, hash: bytes):
+    return {
+        'idx': header.idx,
+        'timestamp': header.timestamp,
+        'previous_hash': base64.b64encode(header.previous_hash).decode(),
+        'merkle_root': base64.b64encode(header.merkle_root).decode(),
+        'difficulty': header.difficulty,
+        'nonce': header.nonce,
+        'hash': base64.b64encode(hash).decode(),
+    }
+
+
+def header_from_json(json_data):
+    header = BlockHeader(
+        json_data['idx'],
+        json_data['timestamp'],
+        base64.b64decode(json_data['previous_hash']),
+        base64.b64decode(json_data['merkle_root']),
+        json_data['difficulty'],
+        json_data['nonce'],
+    )
+    return header, base64.b64decode(json_data['hash'])
+
+
+class SyncServer:
+    """
+    Serves the headers and blocks of a core to syncing nodes.
+
+    {'type': 'getheaders', 'start': height, 'count': n} is answered with
+    {'type': 'headers', 'headers': [...]}, at most n headers from `start`.
+    {'type': 'getblocks', 'start': height, 'count': n} is answered with n
+    messages, one block message or NOTFOUND for each height.
+    """
+
+    def __init__(self, core: SanchainCore, wire_format: str = 'json', max_headers: int = 2000) -> None:
+        self.core = core
+        self.mh = MH(wire_format)
+        self.max_headers = max_headers
+
+    async def handler(self, websocket, path=None):
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                count = min(request['count'], self.max_headers)
+                if request['type'] == GETHEADERS:
+                    headers = await asyncio.to_thread(
+                        self.core.get_headers, request['start'], count)
+                    await websocket.send(json.dumps({
+                        'type': HEADERS,
+                        'headers': [header_to_json(*header) for header in headers],
+                    }))
+                elif request['type'] == GETBLOCKS:
+                    for idx in range(request['start'], request['start'] + count):
+                        block = await asyncio.to_thread(self.get_block_message, idx)
+                        await websocket.send(NOTFOUND if block is None else block)
+        except websockets.ConnectionClosed:
+            pass
+
+    def get_block_message(self, idx: int):
+        """The block at height `idx` in the wire format, or None. Binary
+        messages come from SanchainCore.get_raw_block, which serves the
+        bytes of block files without decoding them."""
+        if self.mh.wire_format == 'binary':
+            return self.core.get_raw_block(idx)
+        block = self.core.get_block(idx)
+        return None if block is None else self.mh.convert(block)
+
+    async def serve(self, host: str, port: int):
+        async with websockets.serve(self.handler, host, port):
+            print(f"Sync server started at ws://{host}:{port}")
+            await asyncio.Future()  # run forever
+
+
+class ChainSync:
+    """
+    Header-first sync of a core with several peers (SyncServer URIs).
+
+    The headers beyond the local chain are fetched from every peer and
+    checked for their links, difficulty and proof of work before any block
+    is downloaded. Peers that send an invalid header chain are dropped and
+    the longest valid chain is followed. The blocks are then downloaded in
+    ranges of `batch_size` from all peers at once, each peer working on one
+    range at a time, at most `window` blocks ahead of the next block to add.
+    Every block must hash to its validated header and match its merkle root,
+    and is added in order with SanchainCore.receive_block. A peer that sends
+    a wrong block, one that is rejected, fails or times out is dropped, and
+    its range is downloaded from the others, so peers with nothing left to
+    download wait until every block is received.
+    """
+
+    def __init__(self, core: SanchainCore, peers: list[str], window: int = 256, batch_size: int = 16,
+                 header_batch: int = 2000, timeout: float = 30, executor: Executor | None = None,
+                 verbose: bool = False) -> None:
+        self.core = core
+        self.peers = peers
+        self.window = window
+        self.batch_size = batch_size
+        self.header_batch = header_batch
+        self.timeout = timeout
+        self.executor = executor  # for the signature checks of receive_block
+        self.verbose = verbose
+
+    async def run(self):
+        """Syncs the core and returns the number of blocks added."""
+        connections = []
+        for uri in self.peers:
+            try:
+                connections.append(await websockets.connect(uri, max_size=MAX_MESSAGE_SIZE))
+            except OSError as e:
+                if self.verbose:
+                    print(f"Could not connect to {uri}: {e}")
+        if not connections:
+            raise SyncError("No peer to sync with")
+
+        try:
+            headers = await self.__fetch_headers(connections)
+            if self.verbose:
+                print(f"{len(headers)} new headers from {len(connections)} peers.")
+            if headers:
+                await self.__download(connections, headers)
+            return len(headers)
+        finally:
+            for connection in connections:
+                await connection.close()
+
+    async def __request(self, connection, request: dict):
+        await connection.send(json.dumps(request))
+
+    async def __receive(self, connection):
+        return await asyncio.wait_for(connection.recv(), self.timeout)
+
+    def __valid_headers(self, headers: list, idx: int, hash: bytes):
+        """Checks that the headers extend the block `idx` with hash `hash`."""
+        for header, header_hash in headers:
+            if header.idx != idx + 1 or header.previous_hash != hash \
+                    or header.difficulty != self.core.config.difficulty \
+                    or not header.has_valid_proof(header_hash):
+                return False
+            idx, hash = header.idx, header_hash
+        return True
+
+    async def __fetch_chain(self, connection):
+        """The headers of the peer beyond the local chain."""
+        headers = []
+        idx, hash = self.core.config.last_block_index, self.core.config.last_block_hash
+        while True:
+            await self.__request(connection, {
+                'type': GETHEADERS, 'start': idx + 1, 'count': self.header_batch})
+            batch = [header_from_json(header) for header in
+                     json.loads(await self.__receive(connection))['headers']]
+            if not self.__valid_headers(batch, idx, hash):
+                raise SyncError("Invalid header chain")
+            headers += batch
+            if len(batch) < self.header_batch:
+                return headers
+            idx, hash = batch[-1][0].idx, batch[-1][1]
+
+    async def __fetch_headers(self, connections: list):
+        """Asks every peer for its headers and returns the longest valid chain."""
+        chains = await asyncio.gather(
+            *[self.__fetch_chain(connection) for connection in connections], return_exceptions=True)
+        longest = None
+        for connection, chain in zip(list(connections), chains):
+            if isinstance(chain, (SyncError, asyncio.TimeoutError, websockets.ConnectionClosed, KeyError, ValueError)):
+                if self.verbose:
+                    print(f"Dropping peer {connection.remote_address}: {chain!r}")
+                connections.remove(connection)
+                await connection.close()
+            elif isinstance(chain, BaseException):
+                raise chain
+            elif longest is None or len(chain) > len(longest):
+                longest = chain
+        if longest is None:
+            raise SyncError("No peer sent a valid header chain")
+        return longest
+
+    async def __download(self, connections: list, headers: list):
+        first = headers[0][0].idx
+        hashes = [hash for _, hash in headers]
+        end = first + len(hashes)
+        state = {
+            'next': first,  # next height to request
+            'apply': first,  # next height to add to the core
+            'retry': [],  # (start, count) ranges to request again
+            'peers': len(connections),
+        }
+        received = {}  # height -> (block, connection)
+        dropped = set()  # connections that sent a rejected block
+        changed = asyncio.Condition()
+
+        async def take_range(connection):
+            """The next range to download, or None once every block is
+            added or the peer is dropped. A peer with nothing to download
+            waits, as the ranges of failing peers and the rejected blocks
+            are downloaded again."""
+            async with changed:
+                while True:
+                    if connection in dropped or state['apply'] >= end:
+                        return None
+                    if state['retry']:
+                        return state['retry'].pop()
+                    if state['next'] < min(end, state['apply'] + self.window):
+                        start = state['next']
+                        count = min(self.batch_size, end - start)
+                        state['next'] += count
+                        return start, count
+                    await changed.wait()
+
+        async def download(connection):
+            try:
+                while (batch := await take_range(connection)) is not None:
+                    start, count = batch
+                    try:
+                        await self.__request(connection, {'type': GETBLOCKS, 'start': start, 'count': count})
+                        blocks = []
+                        for idx in range(start, start + count):
+                            message = await self.__receive(connection)
+                            block = None if message == NOTFOUND else MH.revert(message)
+                            # the hash and merkle root fields are copied data, so
+                            # the header and the root are computed from the block
+                            if not isinstance(block, Block) or block.idx != idx \
+                                    or block.header().calculate_hash() != hashes[idx - first] \
+                                    or block.merkle_tree().root != block.merkle_root:
+                                raise SyncError(f"Block {idx} does not match its header")
+                            blocks.append(block)
+                    except Exception as e:
+                        if self.verbose:
+                            print(f"Dropping peer {connection.remote_address}: {e!r}")
+                        async with changed:
+                            state['retry'].append(batch)
+                            changed.notify_all()
+                        return
+                    async with changed:
+                        if connection in dropped:
+                            state['retry'].append(batch)
+                        else:
+                            for block in blocks:
+                                received[block.idx] = (block, connection)
+                        changed.notify_all()
+            finally:
+                # every exit counts, so that apply() stops waiting once no peer is left
+                async with changed:
+                    state['peers'] -= 1
+                    changed.notify_all()
+
+        async def apply():
+            loop = asyncio.get_running_loop()
+            while state['apply'] < end:
+                async with changed:
+                    while state['apply'] not in received:
+                        if not state['peers']:
+                            raise SyncError(f"No peer left to download block {state['apply']}")
+                        await changed.wait()
+                    block, connection = received.pop(state['apply'])
+                accepted = await loop.run_in_executor(None, self.core.receive_block, block, self.executor)
+                async with changed:
+                    if accepted:
+                        state['apply'] += 1
+                    else:
+                        # the header does not cover every field of the
+                        # transactions, so the block is asked from the others
+                        if self.verbose:
+                            print(f"Dropping peer {connection.remote_address}: block {block.idx} was rejected")
+                        dropped.add(connection)
+                        heights = [block.idx] + sorted(
+                            idx for idx, (_, sender) in received.items() if sender is connection)
+                        for idx in heights[1:]:
+                            del received[idx]
+                        # the lowest heights are popped first
+                        for idx in reversed(heights):
+                            state['retry'].append((idx, 1))
+                    changed.notify_all()
+
+        downloads = [asyncio.create_task(download(connection)) for connection in connections]
+        try:
+            await apply()
+        finally:
+            for task in downloads:
+                task.cancel()
+            await asyncio.gather(*downloads, return_exceptions=True)
@@ -63,20 +63,26 @@ class SanchainConfig(AbstractSanchainModel):
             # TODO: Get config from network
             return cls.default(core_id)
 
-    def refresh(self):
-        """Refreshes the config from the local file."""
-        self = self.load_local()
+    def refresh(self, source=None):
+        """Refreshes the config from `source` or else from the local file."""
+        if source is None:
+            source = self.load_local(self.core_id)
+        self.__dict__.update(source.__dict__)
+
+    def apply_block(self, block):
+        """Updates the config parameters with respect to the recent block
+        for self only."""
+        self.last_block_index = block.idx
+        self.last_block_hash = block.hash
+        # last transaction is the reward transaction
+        self.circulation += block.transactions[-1].amount
 
     def update_wrt_recent_block(self, block):
         """
         Updates the config parameters with respect to the recent block
         both locally and for self.
         """
-        self.last_block_index = block.idx
-        self.last_block_hash = block.hash
-        # last transaction is the reward transaction
-        self.circulation += block.transactions[-1].amount
-
+        self.apply_block(block)
         self.update_local_config()
 
     def update_local_config(self):
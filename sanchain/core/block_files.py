@@ -0,0 +1,98 @@
+import mmap
+import os
+import pathlib
+import threading
+
+from .storage import Storage
+
+
+class BlockFiles:
+    """
+    Append-only store of encoded blocks in segment files (blk00000.dat,
+    blk00001.dat, ...) with an index of height and hash to (file, offset,
+    length) in the database. A new segment is started once the current one
+    would exceed `segment_size`. Blocks are read through memory maps, so
+    serving a block is a copy of its bytes.
+
+    The index row of a block is written in the transaction of the block,
+    after its bytes are synced to disk. Bytes past the last indexed block
+    are left by a rolled back block and are overwritten by the next one.
+    """
+
+    SEGMENT_SIZE = 128 * 1024 * 1024  # bytes
+
+    db_columns = [
+        ('idx', 'INTEGER PRIMARY KEY'),
+        ('hash', 'BLOB'),
+        ('file', 'INTEGER'),
+        ('offset', 'INTEGER'),
+        ('length', 'INTEGER'),
+    ]
+
+    def __init__(self, storage: Storage, folder: pathlib.Path, segment_size: int = SEGMENT_SIZE) -> None:
+        self.storage = storage
+        self.folder = folder
+        self.segment_size = segment_size
+        self.__maps = {}  # file number -> mmap
+        self.__lock = threading.Lock()
+
+        os.makedirs(folder, exist_ok=True)
+        with self.storage.transaction() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS block_files ({', '.join([f'{column[0]} {column[1]}' for column in self.db_columns])})")
+            conn.execute("CREATE INDEX IF NOT EXISTS block_files_hash ON block_files (hash)")
+
+    def path(self, file: int):
+        return self.folder / f"blk{file:05d}.dat"
+
+    def append(self, idx: int, hash: bytes, data: bytes):
+        """Writes the block after the last indexed one and indexes it. To be
+        called in the transaction that adds the block."""
+        last = self.storage.fetchone(
+            "SELECT file, offset + length FROM block_files ORDER BY idx DESC LIMIT 1")
+        file, offset = last if last else (0, 0)
+        if offset and offset + len(data) > self.segment_size:
+            file, offset = file + 1, 0
+
+        path = self.path(file)
+        with self.__lock, open(path, 'r+b' if path.exists() else 'w+b') as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.storage.execute(
+            "INSERT INTO block_files VALUES (?, ?, ?, ?, ?)",
+            (idx, hash, file, offset, len(data)))
+
+    def read(self, idx: int):
+        """The bytes of the block at height `idx`, or None."""
+        return self.__read(self.storage.fetchone(
+            "SELECT file, offset, length FROM block_files WHERE idx = ?", (idx,)))
+
+    def read_by_hash(self, hash: bytes):
+        """The bytes of the block with the given hash, or None."""
+        return self.__read(self.storage.fetchone(
+            "SELECT file, offset, length FROM block_files WHERE hash = ?", (hash,)))
+
+    def __read(self, location):
+        if location is None:
+            return None
+        file, offset, length = location
+        with self.__lock:
+            map = self.__maps.get(file)
+            if map is None or len(map) < offset + length:
+                # the last segment grows, it is mapped again past its end
+                if map is not None:
+                    map.close()
+                with open(self.path(file), 'rb') as f:
+                    map = self.__maps[file] = mmap.mmap(
+                        f.fileno(), 0, access=mmap.ACCESS_READ)
+            return map[offset:offset + length]
+
+    def close(self):
+        with self.__lock:
+            for map in self.__maps.values():
+                map.close()
+            self.__maps.clear()
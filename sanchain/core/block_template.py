@@ -0,0 +1,55 @@
+from .indexed_heap import IndexedHeap
+
+
+class BlockTemplate:
+    """
+    Priority index of the mempool by fee density, the miner fee per UTXO
+    the transaction uses (its inputs plus the outputs it will create).
+    It is updated as transactions enter and leave the mempool, so picking
+    the transactions for a block does not scan the mempool table.
+    """
+
+    def __init__(self) -> None:
+        self.entries = {}  # uid -> (fee, usage)
+        self.heap = IndexedHeap()  # uids by -density
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, uid: int):
+        return uid in self.entries
+
+    @staticmethod
+    def usage(input_count: int, input_value: float, amount: float):
+        """UTXOs used by a transaction: its inputs, the miner's and receiver's
+        outputs and the sender's change, if any."""
+        return input_count + (3 if input_value > amount else 2)
+
+    @staticmethod
+    def density(fee: float, usage: int):
+        return fee / usage
+
+    def add(self, uid: int, fee: float, usage: int):
+        self.entries[uid] = (fee, usage)
+        self.heap.push(uid, -self.density(fee, usage))
+
+    def remove(self, uid: int):
+        self.entries.pop(uid, None)
+        self.heap.remove(uid)
+
+    def select(self, count_limit: int, usage_limit: int):
+        """Returns the uids of the densest transactions that fit into
+        `count_limit` transactions and `usage_limit` UTXOs, densest first."""
+        selected = []
+        popped = []
+        remaining = usage_limit
+        while len(selected) < count_limit and remaining >= 3 \
+                and (item := self.heap.pop()) is not None:
+            popped.append(item)
+            usage = self.entries[item[1]][1]
+            if usage <= remaining:
+                selected.append(item[1])
+                remaining -= usage
+
+        self.heap.restore(popped)
+        return selected
@@ -0,0 +1,55 @@
+import heapq
+import itertools
+
+
+class IndexedHeap:
+    """
+    Min-heap of uids by key, from which a uid can be removed or added again
+    with another key without searching the heap. Removed and replaced items
+    stay in the heap and are skipped when they come up, the sequence number
+    of an item tells a re-added uid apart.
+    Items are (key, uid, sequence number).
+    """
+
+    def __init__(self) -> None:
+        self.heap = []
+        self.live = {}  # uid -> sequence number of its item
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.live)
+
+    def __contains__(self, uid: int):
+        return uid in self.live
+
+    def push(self, uid: int, key):
+        sequence = self.live[uid] = next(self.sequence)
+        heapq.heappush(self.heap, (key, uid, sequence))
+
+    def remove(self, uid: int):
+        self.live.pop(uid, None)
+        # drop the stale items once they outnumber the live ones
+        if len(self.heap) > 2 * len(self.live) + 64:
+            self.heap = [item for item in self.heap if self.__is_live(item)]
+            heapq.heapify(self.heap)
+
+    def __is_live(self, item):
+        return self.live.get(item[1]) == item[2]
+
+    def peek(self):
+        """The smallest live item, or None."""
+        while self.heap and not self.__is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def pop(self):
+        """Takes the smallest live item off the heap, or returns None. Its uid
+        is not removed, the caller puts the item back with restore()."""
+        item = self.peek()
+        if item is not None:
+            heapq.heappop(self.heap)
+        return item
+
+    def restore(self, items):
+        for item in items:
+            heapq.heappush(self.heap, item)
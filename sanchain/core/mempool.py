@@ -1,103 +1,354 @@
-import sqlite3
-import pathlib
-import base64
+import time
+from concurrent.futures import Executor
 
-from ..models import Transaction, UTXO, BlockReward
+from ..models import Transaction, UTXO, BlockReward, keys
 from ..config import SanchainConfig
+from .storage import Storage
+from .utxo_set import UTXOCache, UTXOSet
+from .block_template import BlockTemplate
+from .spend_index import SpendIndex
+from .mempool_policy import MempoolPolicy
 
 
 class Mempool:
     """
     Mempool class to be aggregated in SanchainCore
+    Transactions are picked for blocks by fee density through a BlockTemplate.
+    A SpendIndex of the reserved UTXOs rejects a transaction spending the
+    same UTXO as one in the mempool, unless it pays more fees than all the
+    transactions it conflicts with, which are then replaced.
+    The size and age of the mempool are bounded by a MempoolPolicy, see sweep().
     """
 
-    def __init__(self, path: pathlib.Path, config: SanchainConfig) -> None:
-        self.path = path
+    # uid, amount and block_index of a mempool row
+    row_numbers_size = 3 * 8
+
+    MAX_TRANSACTIONS = 100_000
+    MAX_BYTES = 64 * 1024 * 1024  # of mempool rows
+    EXPIRY = 24 * 3600  # seconds
+    SWEEP_INTERVAL = 60  # seconds
+    SWEEP_BATCH = 1000  # transactions removed per sweep at most
+
+    def __init__(self, storage: Storage, config: SanchainConfig, utxo_set: UTXOSet,
+                 max_transactions: int = MAX_TRANSACTIONS, max_bytes: int = MAX_BYTES,
+                 expiry: float = EXPIRY) -> None:
+        self.storage = storage
         self.config = config
+        self.utxo_set = utxo_set
+        self.template: BlockTemplate | None = None  # built on first use
+        self.spends: SpendIndex | None = None  # built with the template
+        self.policy = MempoolPolicy(max_transactions, max_bytes, expiry)
+        self.__data_version = None
+        self.__last_sweep = time.monotonic()
+
+    def __load_template(self):
+        """Builds the block template, the spend index and the policy entries
+        from the mempool table, again if another connection (e.g. a wallet
+        process) changed the database. Transactions that were not known
+        before are considered to arrive now."""
+        version = self.storage.data_version()
+        if self.template is not None and version == self.__data_version:
+            return self.template
+
+        self.utxo_set.flush()
+        rows = self.storage.fetchall(
+            "SELECT mempool.uid, mempool.amount, COUNT(utxos.uid), COALESCE(SUM(utxos.value), 0.0), "
+            "LENGTH(mempool.sender) + LENGTH(mempool.receiver) + LENGTH(mempool.signature) + LENGTH(mempool.hash) "
+            "FROM mempool LEFT JOIN utxos ON utxos.spender_transaction_uid = mempool.uid "
+            "GROUP BY mempool.uid"
+        )
+        self.template = BlockTemplate()
+        arrivals = {uid: entry[2] for uid, entry in self.policy.entries.items()}
+        self.policy = MempoolPolicy(self.policy.max_transactions, self.policy.max_bytes, self.policy.expiry)
+        entries = []
+        now = time.time()
+        for uid, amount, input_count, input_value, blob_size in rows:
+            fee = amount * self.config.miner_fees
+            usage = BlockTemplate.usage(input_count, input_value, amount)
+            self.template.add(uid, fee, usage)
+            entries.append((arrivals.get(uid, now), uid, BlockTemplate.density(fee, usage),
+                            blob_size + self.row_numbers_size))
+        for arrival, uid, density, size in sorted(entries):
+            self.policy.add(uid, density, size, arrival)
+
+        self.spends = SpendIndex()
+        inputs = {}
+        for utxo_uid, uid in self.storage.fetchall(
+                "SELECT utxos.uid, mempool.uid FROM mempool "
+                "JOIN utxos ON utxos.spender_transaction_uid = mempool.uid"):
+            inputs.setdefault(uid, []).append(utxo_uid)
+        for uid, utxo_uids in inputs.items():
+            self.spends.add(uid, utxo_uids)
+        self.__data_version = version
+        return self.template
 
     def read_transactions(self, limit: int = None):
-        """Read `limit` amount of transactions.
+        """Read up to `limit` transactions with the highest fee density that
+        fit into CONFIG.block_UTXO_usage_limit.
         By default, limit is CONFIG.block_height_limit."""
 
         if not limit:
             limit = self.config.block_height_limit
 
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT * FROM mempool LIMIT {limit}")
-            txns = []
-            sanchain_sender = base64.b64encode(
-                self.config.REWARD_SENDER.public_key.save_pkcs1("DER"))
-            for row in cursor.fetchall():
-
-                if row[1] != sanchain_sender:
-
-                    # fetch input utxos via uid and output utxos via hash
-                    # and append to the row
-
-                    cursor.execute(
-                        f"SELECT * FROM utxos WHERE transaction_hash = {row[6]}")
-                    utxos = []
-                    for utxo_row in cursor.fetchall():
-                        utxos.append(UTXO.from_db_row(utxo_row))
-
-                    cursor.execute(
-                        f"SELECT * FROM utxos WHERE spender_transaction_uid = {row[0]}")
-                    nascent_utxos = []
-                    for nascent_utxo_row in cursor.fetchall():
-                        nascent_utxos.append(
-                            UTXO.from_db_row(nascent_utxo_row))
-
-                    row = list(row)
-                    row.append(nascent_utxos)
-                    row.append(utxos)
-                    txns.append(Transaction.from_db_row(row))
-                else:
-
-                    cursor.execute(
-                        f"SELECT * FROM utxos WHERE transaction_hash = {row[6]}")
-                    utxos = []
-                    for utxo_row in cursor.fetchall():
-                        utxos.append(UTXO.from_db_row(utxo_row))
-
-                    cursor.execute(
-                        f"SELECT * FROM utxos WHERE spender_transaction_uid = {row[0]}")
-                    nascent_utxos = []
-                    for nascent_utxo_row in cursor.fetchall():
-                        nascent_utxos.append(
-                            UTXO.from_db_row(nascent_utxo_row))
-
-                    row = list(row)
-                    row.append(nascent_utxos)
-                    row.append(utxos)
-                    txns.append(BlockReward.from_db_row(row))
-            return txns
+        # one UTXO is left for the block reward
+        uids = self.__load_template().select(
+            limit, self.config.block_UTXO_usage_limit - 1)
+
+        rows = {row[0]: row for row in self.storage.fetch_in('mempool', 'uid', uids)}
+        rows = [rows[uid] for uid in uids if uid in rows]
+
+        # input utxos are reserved via the spender uid, output utxos
+        # (if any) reference the transaction hash
+        inputs = self.__group_utxos(
+            'spender_transaction_uid', [row[0] for row in rows])
+        outputs = self.__group_utxos(
+            'transaction_hash', [row[5] for row in rows if row[5]])
+
+        sanchain_sender = keys.b64(self.config.REWARD_SENDER.public_key).encode()
+        txns = []
+        for row in rows:
+            model = BlockReward if row[1] == sanchain_sender else Transaction
+            txns.append(model.from_db_row(
+                list(row) + [inputs.get(row[0], []), outputs.get(row[5], [])]))
+        return txns
+
+    def __group_utxos(self, column: str, keys: list):
+        """Fetches the UTXOs whose `column` is in `keys`, grouped by that column."""
+        self.utxo_set.flush()
+        position = [name for name, _ in UTXO.db_columns].index(column)
+        grouped = {}
+        for row in self.storage.fetch_in('utxos', column, keys):
+            grouped.setdefault(row[position], []).append(UTXO.from_db_row(row))
+        return grouped
+
+    def __replaced(self, transaction: Transaction, ignored: set = frozenset()):
+        """The mempool transactions that `transaction` conflicts with and
+        outbids, or None if it conflicts with one and doesn't pay more fees
+        than all of them. Transactions in `ignored` are already replaced."""
+        conflicts = self.spends.conflicts(
+            [utxo.uid for utxo in transaction.utxos]) - ignored
+        if conflicts and transaction.amount * self.config.miner_fees <= sum(
+                self.template.entries[uid][0] for uid in conflicts if uid in self.template):
+            return None
+        return conflicts
+
+    def __evict(self, conn, uids):
+        """Deletes mempool transactions and frees their UTXOs, in the
+        caller's database transaction."""
+        if not uids:
+            return
+        conn.executemany("DELETE FROM mempool WHERE uid = ?", [(uid,) for uid in uids])
+        self.utxo_set.set_spenders({
+            utxo_uid: -1 for uid in uids for utxo_uid in self.spends.inputs.get(uid, [])})
+
+    def __drop_from_indexes(self, uids):
+        for uid in uids:
+            self.template.remove(uid)
+            self.spends.remove(uid)
+            self.policy.remove(uid)
+
+    def __admits(self, transaction: Transaction):
+        """Whether the policy keeps the transaction, see MempoolPolicy.admits."""
+        fee, usage = self.__fee_and_usage(transaction)
+        return self.policy.admits(BlockTemplate.density(fee, usage), self.__row_size(transaction))
+
+    def __row_size(self, transaction: Transaction):
+        """Bytes of the mempool row of the transaction."""
+        return len(keys.b64(transaction.sender)) + len(keys.b64(transaction.receiver)) \
+            + len(transaction.signature) + len(transaction.hash) + self.row_numbers_size
 
     def add_transaction(self, transaction: Transaction):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"INSERT INTO mempool VALUES ({', '.join(['?' for _ in range(len(Transaction.db_columns))])})",
-                transaction.to_db_row()
-            )
+        """Adds a transaction and reserves its UTXOs. The transaction is
+        expected to be verified. Returns False if it is rejected because of
+        a conflicting mempool transaction."""
+        try:
+            with self.storage.transaction() as conn:
+                self.__load_template()
+                replaced = self.__replaced(transaction)
+                if replaced is None or not self.__admits(transaction):
+                    return False
+                self.__evict(conn, replaced)
+                conn.execute(
+                    f"INSERT INTO mempool VALUES ({', '.join(['?' for _ in range(len(Transaction.db_columns))])})",
+                    transaction.to_db_row()
+                )
+
+                # add spender transaction uid to the UTXOs
+                self.utxo_set.set_spender(transaction.utxos, transaction.uid)
+        except BaseException:
+            # reservations may have been cached before the rollback
+            self.utxo_set.invalidate()
+            raise
+
+        self.__drop_from_indexes(replaced)
+        self.__add_to_indexes(transaction)
+        self.__sweep_if_due()
+        return True
+
+    def add_transactions(self, transactions: list[Transaction], executor: Executor | None = None):
+        """Verifies a batch of transactions and adds the valid ones with their
+        reservations in one database transaction. Returns a verdict for each
+        transaction. Besides its signature and UTXOs (see Transaction.verify_many),
+        each input must be in the UTXO set as given and not spent by an earlier
+        transaction of the batch. Conflicts with mempool transactions are
+        resolved as in add_transaction."""
+        # losing conflicts are rejected before their signatures are checked
+        self.__load_template()
+        verdicts = [self.__replaced(transaction) is not None and self.__admits(transaction)
+                    for transaction in transactions]
+        checked = iter(Transaction.verify_many(
+            [transaction for transaction, is_valid in zip(transactions, verdicts) if is_valid],
+            self.config, executor))
+        verdicts = [is_valid and next(checked) for is_valid in verdicts]
+        candidates = [transaction for transaction, is_valid in zip(transactions, verdicts) if is_valid]
+
+        try:
+            with self.storage.transaction() as conn:
+                self.__load_template()
+                stored = self.utxo_set.fetch_by_uids(
+                    [utxo.uid for transaction in candidates for utxo in transaction.utxos])
+                pending = {row[0] for row in self.storage.fetch_in(
+                    'mempool', 'uid', [transaction.uid for transaction in candidates])}
+
+                accepted = []
+                replaced = set()  # mempool transactions outbid by the accepted ones
+                claimed = set()  # inputs of the accepted transactions
+                for i, transaction in enumerate(transactions):
+                    if not verdicts[i]:
+                        continue
+                    inputs = {utxo.uid for utxo in transaction.utxos}
+                    conflicts = self.__replaced(transaction, replaced)
+                    verdicts[i] = conflicts is not None \
+                        and transaction.uid not in pending \
+                        and len(inputs) == len(transaction.utxos) \
+                        and inputs.isdisjoint(claimed) \
+                        and all(self.__is_spendable(utxo, stored.get(utxo.uid)) for utxo in transaction.utxos)
+                    if verdicts[i]:
+                        pending.add(transaction.uid)
+                        replaced |= conflicts
+                        claimed |= inputs
+                        accepted.append(transaction)
+
+                self.__evict(conn, replaced)
+                if accepted:
+                    conn.executemany(
+                        f"INSERT INTO mempool VALUES ({', '.join(['?' for _ in range(len(Transaction.db_columns))])})",
+                        [transaction.to_db_row() for transaction in accepted]
+                    )
+                    self.utxo_set.set_spenders({
+                        utxo.uid: transaction.uid
+                        for transaction in accepted for utxo in transaction.utxos})
+        except BaseException:
+            # reservations may have been cached before the rollback
+            self.utxo_set.invalidate()
+            raise
+
+        self.__drop_from_indexes(replaced)
+        for transaction in accepted:
+            self.__add_to_indexes(transaction)
+        self.__sweep_if_due()
+        return verdicts
+
+    def __is_spendable(self, utxo: UTXO, stored: UTXO | None):
+        """Whether the UTXO matches the UTXO set and is unreserved or
+        reserved by a mempool transaction (a conflict)."""
+        return stored is not None \
+            and stored.spender_transaction_uid == self.spends.spender(utxo.uid) \
+            and UTXOCache.row(utxo)[:-1] == UTXOCache.row(stored)[:-1]
+
+    def __fee_and_usage(self, transaction: Transaction):
+        return (
+            transaction.amount * self.config.miner_fees,
+            BlockTemplate.usage(
+                len(transaction.utxos),
+                sum([utxo.value for utxo in transaction.utxos]),
+                transaction.amount,
+            ),
+        )
+
+    def __add_to_indexes(self, transaction: Transaction):
+        fee, usage = self.__fee_and_usage(transaction)
+        self.template.add(transaction.uid, fee, usage)
+        self.spends.add(transaction.uid, [utxo.uid for utxo in transaction.utxos])
+        self.policy.add(transaction.uid, BlockTemplate.density(fee, usage),
+                        self.__row_size(transaction), time.time())
+
+    def __sweep_if_due(self):
+        if time.monotonic() - self.__last_sweep >= self.SWEEP_INTERVAL:
+            self.sweep()
+            return
+        # the limits hold after every admission
+        excess = self.policy.excess(self.SWEEP_BATCH)
+        if excess:
+            try:
+                with self.storage.transaction() as conn:
+                    self.__evict(conn, excess)
+            except BaseException:
+                self.utxo_set.invalidate()
+                raise
+            self.__drop_from_indexes(excess)
+
+    def sweep(self, limit: int = SWEEP_BATCH):
+        """Removes up to `limit` transactions: the expired ones, then the
+        ones with the lowest fee density while the mempool is over its
+        limits. Their UTXOs are freed, as well as up to `limit` UTXOs still
+        reserved by transactions that are no longer in the mempool (e.g.
+        invalid transactions dropped by a miner). Runs every SWEEP_INTERVAL
+        seconds during admission and can be called by a miner between
+        blocks, the size limits are also enforced after every admission.
+        Returns the uids of the removed transactions."""
+        self.__last_sweep = time.monotonic()
+        self.__load_template()
+        uids = self.policy.expired(time.time(), limit)
+        uids += self.policy.excess(limit - len(uids), set(uids))
+
+        try:
+            with self.storage.transaction() as conn:
+                self.__evict(conn, uids)
+                self.utxo_set.flush()
+                # reserved UTXOs, through the spender index as uids are positive
+                orphans = conn.execute(
+                    "SELECT uid FROM utxos WHERE spender_transaction_uid >= 0 "
+                    "AND spender_transaction_uid NOT IN (SELECT uid FROM mempool) LIMIT ?",
+                    (limit,)
+                ).fetchall()
+                if orphans:
+                    self.utxo_set.set_spenders({uid: -1 for uid, in orphans})
+        except BaseException:
+            self.utxo_set.invalidate()
+            raise
+
+        self.__drop_from_indexes(uids)
+        return uids
 
-            # add spender transaction uid to the UTXOs
-            for utxo in transaction.utxos:
-                cursor.execute(
-                    f"UPDATE utxos SET spender_transaction_uid = {transaction.uid} WHERE uid = {utxo.uid}")
+    def remove_confirmed(self, transactions: list[Transaction]):
+        """Removes the transactions of a block added to the chain from the
+        mempool, and evicts the mempool transactions that spend the same
+        UTXOs, whose other UTXOs are freed. Returns the uids of the evicted
+        transactions."""
+        self.__load_template()
+        confirmed = {transaction.uid for transaction in transactions if transaction.uid in self.template}
+        conflicts = self.spends.conflicts(
+            [utxo.uid for transaction in transactions for utxo in transaction.utxos]) - confirmed
+        try:
+            with self.storage.transaction() as conn:
+                # the UTXOs spent by the block are gone, the others are freed
+                self.__evict(conn, confirmed | conflicts)
+        except BaseException:
+            self.utxo_set.invalidate()
+            raise
 
-            conn.commit()
+        self.__drop_from_indexes(confirmed | conflicts)
+        return list(conflicts)
 
     def remove_transaction(self, transaction: Transaction):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"DELETE FROM mempool WHERE uid = {transaction.uid}")
-            conn.commit()
+        self.storage.execute(
+            "DELETE FROM mempool WHERE uid = ?", (transaction.uid,))
+        if self.template is not None:
+            self.__drop_from_indexes([transaction.uid])
 
     def update_transaction(self, transaction: Transaction):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"UPDATE mempool SET {', '.join([f'{column[0]} = ?' for column in Transaction.db_columns])} WHERE uid = {transaction.uid}",
-            )
+        self.storage.execute(
+            f"UPDATE mempool SET {', '.join([f'{column[0]} = ?' for column in Transaction.db_columns])} WHERE uid = ?",
+            transaction.to_db_row() + (transaction.uid,)
+        )
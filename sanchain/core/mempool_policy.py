@@ -0,0 +1,85 @@
+from .indexed_heap import IndexedHeap
+
+
+class MempoolPolicy:
+    """
+    Limits of the mempool: at most `max_transactions` transactions and
+    `max_bytes` bytes of mempool rows, and no transaction older than
+    `expiry` seconds. Keeps the fee density, size and arrival time of each
+    transaction, so that the ones to drop are found without a query:
+    the lowest fee density first, the order in which the block template
+    would pick them last, and the oldest first for expiry.
+    """
+
+    def __init__(self, max_transactions: int, max_bytes: int, expiry: float) -> None:
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        self.entries = {}  # uid -> (density, size, arrival)
+        self.size = 0
+        self.cheapest = IndexedHeap()  # uids by density
+        self.arrivals = IndexedHeap()  # uids by arrival
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, uid: int):
+        return uid in self.entries
+
+    def add(self, uid: int, density: float, size: int, arrival: float):
+        self.remove(uid)
+        self.entries[uid] = (density, size, arrival)
+        self.size += size
+        self.cheapest.push(uid, density)
+        self.arrivals.push(uid, arrival)
+
+    def remove(self, uid: int):
+        entry = self.entries.pop(uid, None)
+        if entry is not None:
+            self.size -= entry[1]
+        self.cheapest.remove(uid)
+        self.arrivals.remove(uid)
+
+    def is_full(self, size: int = 0):
+        return len(self.entries) >= self.max_transactions \
+            or self.size + size > self.max_bytes
+
+    def admits(self, density: float, size: int):
+        """Whether a transaction would stay in the mempool: there is room
+        for it or it pays a higher fee density than the cheapest one."""
+        if not self.is_full(size):
+            return True
+        cheapest = self.cheapest.peek()
+        return cheapest is not None and density > cheapest[0]
+
+    def expired(self, now: float, limit: int):
+        """Up to `limit` uids of transactions that arrived more than
+        `expiry` seconds before `now`, oldest first."""
+        uids = []
+        popped = []
+        while len(uids) < limit and (item := self.arrivals.pop()) is not None:
+            popped.append(item)
+            if item[0] > now - self.expiry:
+                break
+            uids.append(item[1])
+        self.arrivals.restore(popped)
+        return uids
+
+    def excess(self, limit: int, ignored: set = frozenset()):
+        """Up to `limit` uids of the cheapest transactions to drop to get
+        within the limits, once the transactions in `ignored` are dropped."""
+        count = len(self.entries) - len(ignored)
+        size = self.size - sum(self.entries[uid][1] for uid in ignored if uid in self.entries)
+        uids = []
+        popped = []
+        while len(uids) < limit and (count > self.max_transactions or size > self.max_bytes) \
+                and (item := self.cheapest.pop()) is not None:
+            popped.append(item)
+            if item[1] in ignored:
+                continue
+            uids.append(item[1])
+            count -= 1
+            size -= self.entries[item[1]][1]
+
+        self.cheapest.restore(popped)
+        return uids
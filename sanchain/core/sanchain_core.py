@@ -1,11 +1,15 @@
-import sqlite3
 import os
+import asyncio
 import pathlib
+from concurrent.futures import Executor
 
-from ..models import Block, Transaction, UTXO
+from ..models import Block, BlockHeader, BlockReward, Transaction, UTXO, keys
 from ..config import SanchainConfig
 from .mempool import Mempool
 from .utxo_set import UTXOSet
+from .storage import Storage
+from .snapshot import Snapshot
+from .block_files import BlockFiles
 
 
 class SanchainCore:
@@ -20,76 +24,102 @@ class SanchainCore:
     Use SanchainCore.new() to initialize a new blockchain.
     Use SanchainCore().sync() to sync the blockchain with the network.
     Use Sanchain().delete_local() to delete the local blockchain.
+
+    With block_files=True, blocks are appended to flat files (see
+    BlockFiles) instead of being split across the database tables, which
+    then hold the UTXO set, the block headers and the lookup indexes.
     """
 
     DB_NAME = 'sanchainCore.db'
+    BLOCK_FOLDER = 'blocks'
+    UTXO_CACHE_BUDGET = 64 * 1024 * 1024  # bytes
 
-    def __init__(self, path: pathlib.Path, config: SanchainConfig):
+    def __init__(self, path: pathlib.Path, config: SanchainConfig, block_files: bool = False):
         self.path = path
         self.config = config
-        self.mempool = Mempool(self.path, self.config)
-        self.utxo_set = UTXOSet(self.path)
+        self.storage = Storage(self.path)
+        self.utxo_set = UTXOSet(self.storage, self.UTXO_CACHE_BUDGET)
+        self.mempool = Mempool(self.storage, self.config, self.utxo_set)
+        self.block_files = BlockFiles(
+            self.storage, path.parent / self.BLOCK_FOLDER) if block_files else None
 
     @classmethod
-    def new(cls, uid: str):
+    def new(cls, uid: str, block_files: bool = False):
         """Creates a new core without removing the previous one.
         UID is the unique identifier of the core."""
         config = SanchainConfig.default(uid)
         os.mkdir(config.DB_FOLDER / uid)
-        obj = cls(config.DB_FOLDER / uid / cls.DB_NAME, config)
+        obj = cls(config.DB_FOLDER / uid / cls.DB_NAME, config, block_files)
         obj.__create_tables()
         config.update_local_config()
         return obj
 
+    @classmethod
+    def network(cls, uid: str, peers: list[str], block_files: bool = False, **options):
+        """Creates a new core and downloads the blockchain from the peers."""
+        obj = cls.new(uid, block_files)
+        obj.sync(peers, **options)
+        return obj
+
     @classmethod
     def local(cls, uid):
         """Loads the core from disk."""
         config = SanchainConfig.load_local(uid)
-        obj = cls(config.DB_FOLDER / uid / cls.DB_NAME, config)
-        assert os.path.exists(obj.path)
+        path = config.DB_FOLDER / uid / cls.DB_NAME
+        assert os.path.exists(path)
+        obj = cls(path, config, os.path.exists(path.parent / cls.BLOCK_FOLDER))
+        obj.__create_tables()  # adds indexes missing from older databases
+
+        # the config row is committed together with the last block while
+        # the file is written afterwards, so the row wins if they differ
+        row = obj.storage.fetchone(
+            "SELECT * FROM config WHERE version = ?", (config.version,))
+        if row and row != config.to_db_row():
+            config.refresh(SanchainConfig.from_db_row(row, uid))
+            config.update_local_config()
         return obj
 
+    def close(self):
+        """Writes pending UTXO changes and closes the database connection."""
+        self.utxo_set.flush()
+        if self.block_files is not None:
+            self.block_files.close()
+        self.storage.close()
+
     def __create_tables(self):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
+        with self.storage.transaction() as conn:
             queries = [
                 f"CREATE TABLE IF NOT EXISTS blocks ({', '.join([f'{column[0]} {column[1]}' for column in Block.db_columns])})",
                 f"CREATE TABLE IF NOT EXISTS transactions ({', '.join([f'{column[0]} {column[1]}' for column in Transaction.db_columns])})",
                 f"CREATE TABLE IF NOT EXISTS utxos ({', '.join([f'{column[0]} {column[1]}' for column in UTXO.db_columns])})",
                 f"CREATE TABLE IF NOT EXISTS mempool ({', '.join([f'{column[0]} {column[1]}' for column in Transaction.db_columns])})",
+                f"CREATE TABLE IF NOT EXISTS config ({', '.join([f'{column[0]} {column[1]}' for column in SanchainConfig.db_columns])})",
+                # spent UTXOs and the order of the transactions in each block
+                # are kept, so that blocks can be served to syncing nodes
+                f"CREATE TABLE IF NOT EXISTS spent_utxos ({', '.join([f'{column[0]} {column[1]}' for column in UTXO.db_columns])})",
+                "CREATE TABLE IF NOT EXISTS block_transactions (block_index INTEGER, position INTEGER, transaction_uid INTEGER, PRIMARY KEY (block_index, position))",
+                "CREATE INDEX IF NOT EXISTS utxos_spender ON utxos (spender_transaction_uid)",
+                "CREATE INDEX IF NOT EXISTS utxos_transaction_hash ON utxos (transaction_hash)",
+                "CREATE INDEX IF NOT EXISTS utxos_owner ON utxos (verification_key, spender_transaction_uid)",
+                "CREATE INDEX IF NOT EXISTS spent_utxos_spender ON spent_utxos (spender_transaction_uid)",
+                "CREATE INDEX IF NOT EXISTS spent_utxos_transaction_hash ON spent_utxos (transaction_hash)",
+                "CREATE INDEX IF NOT EXISTS blocks_hash ON blocks (hash)",
+                "CREATE INDEX IF NOT EXISTS transactions_hash ON transactions (hash)",
             ]
             for query in queries:
-                cursor.execute(query)
-
-    def __add_utxo(self, utxo: UTXO):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
-                utxo.to_db_row()
-            )
-            conn.commit()
-
-    def __remove_utxo(self, utxo: UTXO):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"DELETE FROM utxos WHERE uid = {utxo.uid}")
-            conn.commit()
-
-    def __add_transaction(self, transaction: Transaction):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"INSERT INTO transactions VALUES ({', '.join(['?' for _ in range(len(Transaction.db_columns))])})",
-                transaction.to_db_row()
-            )
-            conn.commit()
-
-    def get_account_balance(self, verification_key: bytes):
-        """Fetches the account balance from the UTXO set."""
-        utxos = self.utxo_set.fetch_by_owner(verification_key, unused=True)
-        return sum([utxo.value for utxo in utxos])
+                conn.execute(query)
+
+    def get_account_balance(self, verification_key: bytes, include_reserved: bool = False):
+        """Fetches the account balance from the UTXO set.
+        By default, UTXOs reserved by mempool transactions are not counted."""
+        confirmed, reserved = self.utxo_set.balance(verification_key)
+        if include_reserved:
+            return confirmed
+        return confirmed - reserved
+
+    def get_reserved_balance(self, verification_key: bytes):
+        """Fetches the amount reserved by transactions in the mempool."""
+        return self.utxo_set.balance(verification_key)[1]
 
     def create_block(self, transactions: list[Transaction] | None = None):
         """Creates a new block with the transactions.
@@ -103,12 +133,7 @@ class SanchainCore:
         This is to be done when a transaction is invalid but some UTXOs have 
         been committed to it."""
 
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            for utxo in transaction.utxos:
-                cursor.execute(
-                    f"UPDATE utxos SET spender_transaction_uid = -1 WHERE uid = {utxo.uid}")
-            conn.commit()
+        self.utxo_set.set_spender(transaction.utxos, -1)
 
     def validate_utxo(self, utxo: UTXO):
         """Backtracks the UTXO to its origin and validates it."""
@@ -117,25 +142,262 @@ class SanchainCore:
         return utxo == in_set
 
     def add_block(self, block: Block):
-        """Adds a block to the blockchain and updates the config wrt the block."""
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"INSERT INTO blocks VALUES ({', '.join(['?' for _ in range(len(Block.db_columns))])})",
-                block.to_db_row()
-            )
-            conn.commit()
-        self.config.update_wrt_recent_block(block)
-
-        for transaction in block.transactions:
-            self.__add_transaction(transaction)
+        """Adds a block to the blockchain and updates the config wrt the block.
+        The block, its transactions, the spent and new UTXOs and the config
+        are committed at once, or not at all."""
+        # earlier changes must not be rolled back with the block
+        self.utxo_set.flush()
+        try:
+            with self.storage.transaction() as conn:
+                conn.execute(
+                    f"INSERT INTO blocks VALUES ({', '.join(['?' for _ in range(len(Block.db_columns))])})",
+                    block.to_db_row()
+                )
+                conn.executemany(
+                    f"INSERT INTO transactions VALUES ({', '.join(['?' for _ in range(len(Transaction.db_columns))])})",
+                    [transaction.to_db_row()
+                     for transaction in block.transactions]
+                )
+                if self.block_files is not None:
+                    self.block_files.append(block.idx, block.hash, self.__encode(block))
+                else:
+                    conn.executemany(
+                        "INSERT INTO block_transactions VALUES (?, ?, ?)",
+                        [(block.idx, position, transaction.uid)
+                         for position, transaction in enumerate(block.transactions)]
+                    )
+                    conn.executemany(
+                        f"INSERT OR REPLACE INTO spent_utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+                        [utxo.to_db_row()[:-1] + (transaction.uid,)
+                         for transaction in block.transactions for utxo in transaction.utxos]
+                    )
+                for transaction in block.transactions:
+                    for utxo in transaction.utxos:
+                        self.utxo_set.remove_utxo(utxo)
+                    for utxo in transaction.nascent_utxos:
+                        self.utxo_set.add_utxo(utxo)
+                self.utxo_set.flush()
 
-            for utxo in transaction.utxos:
-                self.__remove_utxo(utxo)
+                self.config.apply_block(block)
+                conn.execute(
+                    f"INSERT OR REPLACE INTO config VALUES ({', '.join(['?' for _ in range(len(SanchainConfig.db_columns))])})",
+                    self.config.to_db_row()
+                )
+        except BaseException:
+            self.config.refresh()
+            self.utxo_set.invalidate()
+            raise
 
-            for utxo in transaction.nascent_utxos:
-                self.__add_utxo(utxo)
+        self.config.update_local_config()
 
         # TODO: Broadcast the block to the network
-        # Listen for blocks
-        # Validate blocks
+
+    def get_headers(self, start: int, count: int):
+        """Returns the (header, hash) of up to `count` blocks from height `start`."""
+        rows = self.storage.fetchall(
+            "SELECT idx, timestamp, last_block_hash, merkle_root, difficulty, nonce, hash "
+            "FROM blocks WHERE idx >= ? ORDER BY idx LIMIT ?",
+            (start, count)
+        )
+        return [(BlockHeader(*row[:-1]), row[-1]) for row in rows]
+
+    def get_block(self, idx: int):
+        """Loads the block at height `idx` with its transactions and UTXOs.
+        Returns None if the block is unknown or was added before the
+        order of its transactions was recorded."""
+        if self.block_files is not None:
+            return self.__decode(self.block_files.read(idx))
+        return self.__load_block(
+            self.storage.fetchone("SELECT * FROM blocks WHERE idx = ?", (idx,)))
+
+    def get_block_by_hash(self, hash: bytes):
+        """Loads the block with the given hash, see get_block."""
+        if self.block_files is not None:
+            return self.__decode(self.block_files.read_by_hash(hash))
+        return self.__load_block(
+            self.storage.fetchone("SELECT * FROM blocks WHERE hash = ?", (hash,)))
+
+    def get_raw_block(self, idx: int):
+        """The block at height `idx` encoded with BinaryCodec, or None.
+        With block files, the stored bytes are returned as they are."""
+        if self.block_files is not None:
+            return self.block_files.read(idx)
+        block = self.get_block(idx)
+        return None if block is None else self.__encode(block)
+
+    def get_transactions(self, block_index: int):
+        """Loads the transactions of a block, in block order, with their UTXOs."""
+        if self.block_files is not None:
+            block = self.get_block(block_index)
+            return [] if block is None else block.transactions
+        return self.__load_transactions(self.storage.fetchall(
+            "SELECT transactions.* FROM block_transactions "
+            "JOIN transactions ON transactions.uid = block_transactions.transaction_uid "
+            "WHERE block_transactions.block_index = ? ORDER BY block_transactions.position",
+            (block_index,)
+        ))
+
+    def get_transaction(self, hash: bytes):
+        """Loads a transaction of the blockchain by its hash, or returns None."""
+        if self.block_files is not None:
+            row = self.storage.fetchone(
+                "SELECT block_index FROM transactions WHERE hash = ?", (hash,))
+            if row is None:
+                return None
+            return next((transaction for transaction in self.get_transactions(row[0])
+                         if transaction.hash == hash), None)
+        transactions = self.__load_transactions(self.storage.fetchall(
+            "SELECT * FROM transactions WHERE hash = ?", (hash,)))
+        return transactions[0] if transactions else None
+
+    @staticmethod
+    def __encode(block: Block):
+        from ..broadcast.codec import BinaryCodec  # the broadcast package imports core
+
+        return BinaryCodec.encode_block(block)
+
+    @staticmethod
+    def __decode(data: bytes | None):
+        from ..broadcast.codec import BinaryCodec
+
+        return None if data is None else BinaryCodec.decode(data)
+
+    def __load_block(self, row):
+        if row is None:
+            return None
+        transactions = self.get_transactions(row[0])
+        if not transactions:
+            return None
+        block = Block.from_db_row(row)
+        block.transactions = transactions
+        return block
+
+    def __load_transactions(self, rows):
+        """Rehydrates transaction rows with their input and output UTXOs,
+        in two queries whatever the number of transactions."""
+        if not rows:
+            return []
+
+        self.utxo_set.flush()
+        uids = [row[0] for row in rows]
+        hashes = [row[5] for row in rows]
+        inputs = {}
+        for utxo_row in self.storage.fetchall(
+                f"SELECT * FROM spent_utxos WHERE spender_transaction_uid IN ({', '.join(['?' for _ in uids])}) ORDER BY uid",
+                uids):
+            inputs.setdefault(utxo_row[-1], []).append(UTXO.from_db_row(utxo_row))
+        # outputs were unspent when the block was added
+        outputs = {}
+        placeholders = ', '.join(['?' for _ in hashes])
+        for utxo_row in self.storage.fetchall(
+                f"SELECT * FROM utxos WHERE transaction_hash IN ({placeholders}) "
+                f"UNION ALL SELECT * FROM spent_utxos WHERE transaction_hash IN ({placeholders}) ORDER BY idx",
+                hashes + hashes):
+            outputs.setdefault(utxo_row[4], []).append(
+                UTXO.from_db_row(utxo_row[:-1] + (-1,)))
+
+        reward_sender = keys.b64(self.config.REWARD_SENDER.public_key).encode()
+        transactions = []
+        for transaction_row in rows:
+            model = BlockReward if transaction_row[1] == reward_sender else Transaction
+            transactions.append(model.from_db_row(list(transaction_row) + [
+                inputs.get(transaction_row[0], []), outputs.get(transaction_row[5], [])]))
+        return transactions
+
+    def export_snapshot(self, path: pathlib.Path):
+        """Writes the UTXO set and config at the current height to `path`.
+        Returns the number of UTXOs written."""
+        self.utxo_set.flush()
+        return Snapshot.export(self.storage, self.config, path)
+
+    def load_snapshot(self, path: pathlib.Path):
+        """Bootstraps a new core from a snapshot instead of replaying every
+        block. Blocks after the snapshot height can then be added or synced.
+        The blocks up to the snapshot height are not stored and can't be served."""
+        assert self.config.last_block_index == -1, "Snapshots are loaded into new cores only"
+        self.utxo_set.flush()
+        try:
+            with self.storage.transaction() as conn:
+                # building the indexes after the insert is faster than row by row
+                for (index,) in conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'index' "
+                        "AND tbl_name = 'utxos' AND sql IS NOT NULL").fetchall():
+                    conn.execute(f"DROP INDEX {index}")
+                self.config.refresh(Snapshot.load(self.storage, path, self.config.core_id))
+                self.__create_tables()
+                conn.execute(
+                    f"INSERT OR REPLACE INTO config VALUES ({', '.join(['?' for _ in range(len(SanchainConfig.db_columns))])})",
+                    self.config.to_db_row()
+                )
+        except BaseException:
+            self.config.refresh()
+            raise
+        finally:
+            self.utxo_set.invalidate()
+
+        self.config.update_local_config()
+
+    def sync(self, peers: list[str], **options):
+        """Downloads and adds the blocks that the peers (ws:// URIs of
+        SyncServers) have beyond the local chain.
+        Returns the number of blocks added. See ChainSync for the options."""
+        from ..broadcast.sync import ChainSync  # the broadcast package imports core
+
+        return asyncio.run(ChainSync(self, peers, **options).run())
+
+    def receive_block(self, block: Block, executor: Executor | None = None):
+        """Validates a block received from the network and adds it to the
+        blockchain. Its transactions and the ones spending the same UTXOs
+        leave the mempool. Returns whether the block was accepted."""
+        if not block.validate(self.config, executor) or not self.__valid_utxos(block):
+            return False
+        self.add_block(block)
+        self.mempool.remove_confirmed(block.transactions)
+        return True
+
+    def __valid_utxos(self, block: Block):
+        """Checks the UTXOs of a block against the UTXO set: each input is
+        unspent, as described, and spent once in the block, and the outputs
+        are new and have the values given by Transaction.execute and
+        BlockReward.new. The transaction uids must be new as well. The
+        signatures only cover what the transactions report about their inputs."""
+        *transactions, reward = block.transactions
+        inputs = [utxo for transaction in transactions for utxo in transaction.utxos]
+        outputs = [utxo for transaction in block.transactions for utxo in transaction.nascent_utxos]
+        uids = [utxo.uid for utxo in inputs]
+        transaction_uids = [transaction.uid for transaction in block.transactions]
+        if len(set(uids)) != len(uids) or len({utxo.uid for utxo in outputs}) != len(outputs) \
+                or len(set(transaction_uids)) != len(transaction_uids) \
+                or self.storage.fetch_in('transactions', 'uid', transaction_uids):
+            return False
+        unspent = self.utxo_set.fetch_by_uids(uids + [utxo.uid for utxo in outputs])
+        if len(unspent) != len(uids):
+            return False
+
+        def described(utxo: UTXO):
+            # the spender is the reservation of the sending node, not part of the UTXO
+            return (utxo.verification_key, utxo.value, utxo.idx, utxo.transaction_hash, utxo.block_index)
+
+        if any(utxo.uid not in unspent or described(utxo) != described(unspent[utxo.uid])
+               for utxo in inputs):
+            return False
+
+        miner = keys.verification_key(reward.receiver)
+        expected = {reward.uid: [(miner, self.config.reward, 0)]}
+        for transaction in transactions:
+            if transaction.amount <= 0:
+                return False
+            expected[transaction.uid] = [
+                (miner, transaction.amount * self.config.miner_fees, 0),
+                (keys.verification_key(transaction.receiver), transaction.amount, 1),
+            ]
+            change = sum([utxo.value for utxo in transaction.utxos]) - transaction.amount
+            if change > 0:
+                expected[transaction.uid].append(
+                    (keys.verification_key(transaction.sender), change, 2))
+        return not reward.utxos and all(
+            [(utxo.verification_key, utxo.value, utxo.idx) for utxo in transaction.nascent_utxos]
+            == expected[transaction.uid]
+            and all(utxo.transaction_hash == transaction.hash and utxo.block_index == block.idx
+                    for utxo in transaction.nascent_utxos)
+            for transaction in block.transactions)
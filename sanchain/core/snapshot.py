@@ -0,0 +1,138 @@
+import hashlib
+import pathlib
+import struct
+
+from ..config import SanchainConfig
+from ..models import UTXO
+from .storage import Storage
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class Snapshot:
+    """
+    Checksummed binary dump of the UTXO set and the config at the height
+    of its last block, to bootstrap a node without replaying every block.
+
+    Layout: MAGIC, version, config, key table, UTXO count, UTXO records,
+    then the sha256 of everything before it. Owner verification keys are
+    written once in the key table and referenced by index. Reservations of
+    mempool transactions are not part of the UTXO set and are left out.
+    """
+
+    MAGIC = b'SNS'
+    VERSION = 1
+
+    header_format = struct.Struct('<3sB')
+    # version, difficulty, reward, block_UTXO_usage_limit, miner_fees,
+    # block_height_limit, last_block_index, circulation
+    config_format = struct.Struct('<qqdqdqqd')
+    count_format = struct.Struct('<Q')
+    key_length_format = struct.Struct('<H')
+    # uid, key index, value, idx, block_index, transaction hash length
+    utxo_format = struct.Struct('<qIdqqB')
+
+    @classmethod
+    def export(cls, storage: Storage, config: SanchainConfig, path: pathlib.Path):
+        """Writes the UTXO set and `config` to `path`. Returns the UTXO count."""
+        checksum = hashlib.sha256()
+        with open(path, 'wb') as file:
+            def write(data: bytes):
+                checksum.update(data)
+                file.write(data)
+
+            # one read transaction, so that the set and the config match
+            with storage.transaction() as conn:
+                write(cls.header_format.pack(cls.MAGIC, cls.VERSION))
+                write(cls.config_format.pack(
+                    config.version,
+                    config.difficulty,
+                    config.reward,
+                    config.block_UTXO_usage_limit,
+                    config.miner_fees,
+                    config.block_height_limit,
+                    config.last_block_index,
+                    config.circulation,
+                ))
+                write(cls.key_length_format.pack(len(config.last_block_hash)) + config.last_block_hash)
+
+                keys = {}
+                for (key,) in conn.execute("SELECT DISTINCT verification_key FROM utxos"):
+                    keys[bytes(key)] = len(keys)
+                write(cls.count_format.pack(len(keys)))
+                write(b''.join(cls.key_length_format.pack(len(key)) + key for key in keys))
+
+                count, = conn.execute("SELECT COUNT(*) FROM utxos").fetchone()
+                write(cls.count_format.pack(count))
+                cursor = conn.execute(
+                    "SELECT uid, verification_key, value, idx, transaction_hash, block_index FROM utxos")
+                while rows := cursor.fetchmany(10_000):
+                    write(b''.join(
+                        cls.utxo_format.pack(uid, keys[bytes(key)], value, idx, block_index, len(hash)) + hash
+                        for uid, key, value, idx, hash, block_index in rows))
+            file.write(checksum.digest())
+        return count
+
+    @classmethod
+    def read(cls, path: pathlib.Path, core_id: str):
+        """Checks the snapshot and returns its config and a generator of UTXO rows."""
+        data = memoryview(pathlib.Path(path).read_bytes())
+        body, digest = data[:-32], data[-32:]
+        if hashlib.sha256(body).digest() != digest:
+            raise SnapshotError("Snapshot checksum does not match")
+
+        magic, version = cls.header_format.unpack_from(body)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        offset = cls.header_format.size
+
+        (config_version, difficulty, reward, block_UTXO_usage_limit, miner_fees,
+         block_height_limit, last_block_index, circulation) = cls.config_format.unpack_from(body, offset)
+        offset += cls.config_format.size
+        last_block_hash, offset = cls.__read_key(body, offset)
+        config = SanchainConfig(core_id, config_version, difficulty, reward, block_UTXO_usage_limit,
+                                miner_fees, block_height_limit, last_block_index,
+                                last_block_hash, circulation)
+
+        key_count, = cls.count_format.unpack_from(body, offset)
+        offset += cls.count_format.size
+        keys = []
+        for _ in range(key_count):
+            key, offset = cls.__read_key(body, offset)
+            keys.append(key)
+
+        count, = cls.count_format.unpack_from(body, offset)
+        offset += cls.count_format.size
+
+        def rows(offset=offset):
+            unpack_from, size = cls.utxo_format.unpack_from, cls.utxo_format.size
+            for _ in range(count):
+                uid, key, value, idx, block_index, length = unpack_from(body, offset)
+                offset += size
+                hash = bytes(body[offset:offset + length])
+                offset += length
+                yield uid, keys[key], value, idx, hash, block_index, -1
+
+        return config, rows()
+
+    @staticmethod
+    def __read_key(data: memoryview, offset: int):
+        length, = Snapshot.key_length_format.unpack_from(data, offset)
+        offset += Snapshot.key_length_format.size
+        return bytes(data[offset:offset + length]), offset + length
+
+    @classmethod
+    def load(cls, storage: Storage, path: pathlib.Path, core_id: str):
+        """Fills the empty utxos table from the snapshot and returns its config.
+        The caller commits the config."""
+        config, rows = cls.read(path, core_id)
+        with storage.transaction() as conn:
+            if conn.execute("SELECT 1 FROM utxos LIMIT 1").fetchone():
+                raise SnapshotError("The UTXO set is not empty")
+            conn.executemany(
+                f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+                rows
+            )
+        return config
@@ -0,0 +1,37 @@
+class SpendIndex:
+    """
+    In-memory index of the UTXOs reserved by mempool transactions, kept
+    by Mempool so that a conflicting spend is found at admission by
+    looking up its inputs instead of when the block is mined.
+    """
+
+    def __init__(self) -> None:
+        self.spenders = {}  # UTXO uid -> mempool transaction uid
+        self.inputs = {}  # mempool transaction uid -> UTXO uids
+
+    def __len__(self):
+        return len(self.inputs)
+
+    def __contains__(self, uid: int):
+        return uid in self.inputs
+
+    def spender(self, utxo_uid: int):
+        """The uid of the mempool transaction spending the UTXO, or -1."""
+        return self.spenders.get(utxo_uid, -1)
+
+    def conflicts(self, utxo_uids):
+        """The uids of the mempool transactions spending any of the UTXOs."""
+        return {self.spenders[uid] for uid in utxo_uids if uid in self.spenders}
+
+    def add(self, uid: int, utxo_uids):
+        self.inputs[uid] = list(utxo_uids)
+        for utxo_uid in self.inputs[uid]:
+            self.spenders[utxo_uid] = uid
+
+    def remove(self, uid: int):
+        """Drops a transaction and returns the uids of the UTXOs it spent."""
+        utxo_uids = self.inputs.pop(uid, [])
+        for utxo_uid in utxo_uids:
+            if self.spenders.get(utxo_uid) == uid:
+                del self.spenders[utxo_uid]
+        return utxo_uids
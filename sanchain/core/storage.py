@@ -0,0 +1,104 @@
+import sqlite3
+import pathlib
+import threading
+from contextlib import contextmanager
+
+
+class Storage:
+    """
+    Long-lived SQLite connection shared by SanchainCore, Mempool and UTXOSet.
+    Single statements are committed right away, use Storage().transaction()
+    to group several statements into one commit.
+    """
+
+    pragmas = {
+        'journal_mode': 'WAL',
+        # in WAL mode, NORMAL only syncs at checkpoints instead of every commit
+        'synchronous': 'NORMAL',
+        'cache_size': -64 * 1024,  # negative values are in KiB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    cached_statements = 256
+    # keeps the number of bound parameters under SQLite's default limit
+    max_query_params = 500
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        # statements are wrapped in BEGIN/COMMIT by transaction() only
+        self.conn = sqlite3.connect(
+            path,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        self.__lock = threading.RLock()
+        self.__depth = 0
+
+        for pragma, value in self.pragmas.items():
+            self.conn.execute(f"PRAGMA {pragma} = {value}")
+
+    @contextmanager
+    def transaction(self):
+        """Commits everything executed inside the block at once, or nothing
+        if it raises. Nested blocks become savepoints of the outer one."""
+        with self.__lock:
+            savepoint = f"sp{self.__depth}"
+            if self.__depth:
+                self.conn.execute(f"SAVEPOINT {savepoint}")
+            else:
+                self.conn.execute("BEGIN")
+            self.__depth += 1
+
+            try:
+                yield self.conn
+            except BaseException:
+                self.__depth -= 1
+                if self.__depth:
+                    self.conn.execute(f"ROLLBACK TO {savepoint}")
+                    self.conn.execute(f"RELEASE {savepoint}")
+                else:
+                    self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.__depth -= 1
+                if self.__depth:
+                    self.conn.execute(f"RELEASE {savepoint}")
+                else:
+                    self.conn.execute("COMMIT")
+
+    def execute(self, query: str, params=()):
+        with self.__lock:
+            return self.conn.execute(query, params)
+
+    def executemany(self, query: str, rows):
+        with self.__lock:
+            return self.conn.executemany(query, rows)
+
+    def fetchall(self, query: str, params=()):
+        with self.__lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def fetchone(self, query: str, params=()):
+        with self.__lock:
+            return self.conn.execute(query, params).fetchone()
+
+    def fetch_in(self, table: str, column: str, keys: list):
+        """Fetches the rows of `table` whose `column` is in `keys`, with one
+        query per `max_query_params` keys."""
+        rows = []
+        for i in range(0, len(keys), self.max_query_params):
+            chunk = keys[i:i + self.max_query_params]
+            rows += self.fetchall(
+                f"SELECT * FROM {table} WHERE {column} IN ({', '.join(['?' for _ in chunk])})",
+                chunk
+            )
+        return rows
+
+    def data_version(self):
+        """Changes whenever another connection commits to the database."""
+        return self.fetchone("PRAGMA data_version")[0]
+
+    def close(self):
+        with self.__lock:
+            self.conn.close()
@@ -1,70 +1,342 @@
-import sqlite3
-import pathlib
+from collections import OrderedDict
 
 from ..models import UTXO
+from .storage import Storage
+
+
+class UTXOCache:
+    """
+    LRU cache of UTXO rows indexed by uid and by owner verification key,
+    bounded by an approximate memory budget in bytes.
+    Rows are kept as tuples so that callers can't modify cached entries.
+    Changed rows stay dirty until UTXOSet().flush() writes them.
+    """
+
+    # rough cost of a row tuple and its index entries, without its bytes values
+    entry_overhead = 400
+
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.size = 0
+        self.rows = OrderedDict()  # uid -> row, oldest first
+        self.owners = {}  # verification_key -> set of cached uids
+        self.complete = set()  # owners whose UTXOs are all cached
+        self.dirty = set()  # uids to be written
+        self.removed = set()  # uids to be deleted
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def row(utxo: UTXO):
+        return (
+            utxo.uid,
+            bytes(utxo.verification_key),
+            utxo.value,
+            utxo.idx,
+            bytes(utxo.transaction_hash),
+            utxo.block_index,
+            utxo.spender_transaction_uid,
+        )
+
+    def __entry_size(self, row):
+        return self.entry_overhead + len(row[1]) + len(row[4])
+
+    def get(self, uid: int):
+        """Returns (found, row). row is None for UTXOs known to be removed."""
+        if uid in self.removed:
+            self.hits += 1
+            return True, None
+        if uid in self.rows:
+            self.hits += 1
+            self.rows.move_to_end(uid)
+            return True, self.rows[uid]
+        self.misses += 1
+        return False, None
+
+    def get_owner(self, verification_key: bytes):
+        """Returns the rows of an owner or None if they are not all cached."""
+        if verification_key not in self.complete:
+            self.misses += 1
+            return None
+        self.hits += 1
+        rows = []
+        for uid in self.owners[verification_key]:
+            self.rows.move_to_end(uid)
+            rows.append(self.rows[uid])
+        return rows
+
+    def put(self, row, dirty: bool = False):
+        uid, owner = row[0], row[1]
+        if uid in self.rows:
+            self.__drop(uid)
+        self.rows[uid] = row
+        self.rows.move_to_end(uid)
+        self.size += self.__entry_size(row)
+        self.owners.setdefault(owner, set()).add(uid)
+        self.removed.discard(uid)
+        if dirty:
+            self.dirty.add(uid)
+        self.evict()
+
+    def put_owner(self, verification_key: bytes, rows):
+        """Caches all UTXOs of an owner so that later lookups need no query."""
+        for row in rows:
+            self.put(row)
+        if all(row[0] in self.rows for row in rows):
+            self.owners.setdefault(verification_key, set())
+            self.complete.add(verification_key)
+
+    def remove(self, uid: int):
+        if uid in self.rows:
+            self.__drop(uid)
+        self.dirty.discard(uid)
+        self.removed.add(uid)
+
+    def __drop(self, uid: int):
+        row = self.rows.pop(uid)
+        self.size -= self.__entry_size(row)
+        uids = self.owners.get(row[1])
+        if uids is not None:
+            uids.discard(uid)
+            if not uids and row[1] not in self.complete:
+                del self.owners[row[1]]
+        return row
+
+    def evict(self):
+        """Drops the least recently used clean rows until within budget.
+        Dirty rows found on the way are moved to the end, so that the
+        next calls don't scan them again."""
+        # every dirty uid is cached, so the others are clean
+        while self.size > self.budget and len(self.rows) > len(self.dirty):
+            uid = next(iter(self.rows))
+            if uid in self.dirty:
+                self.rows.move_to_end(uid)
+                continue
+            row = self.__drop(uid)
+            self.complete.discard(row[1])
+            if not self.owners.get(row[1], True):
+                del self.owners[row[1]]
+
+    def clear(self):
+        """Drops everything that has been written to the database."""
+        for uid in list(self.rows):
+            if uid not in self.dirty:
+                self.__drop(uid)
+        self.complete.clear()
+        self.owners = {owner: uids for owner, uids in self.owners.items() if uids}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.rows),
+            'dirty': len(self.dirty) + len(self.removed),
+            'size': self.size,
+            'budget': self.budget,
+        }
+
+
+class BalanceIndex:
+    """Confirmed and reserved (spent by a mempool transaction) balance
+    per owner verification key, kept up to date by UTXOSet."""
+
+    def __init__(self, rows) -> None:
+        # verification_key -> [confirmed, reserved]
+        self.balances = {
+            verification_key: [confirmed, reserved]
+            for verification_key, confirmed, reserved in rows
+        }
+
+    def __update(self, verification_key: bytes, confirmed: float, reserved: float):
+        balance = self.balances.setdefault(verification_key, [0.0, 0.0])
+        balance[0] += confirmed
+        balance[1] += reserved
+        # float residue of a fully spent owner
+        if abs(balance[0]) < 1e-9 and abs(balance[1]) < 1e-9:
+            del self.balances[verification_key]
+
+    def add(self, row):
+        self.__update(row[1], row[2], row[2] if row[-1] != -1 else 0.0)
+
+    def remove(self, row):
+        self.__update(row[1], -row[2], -row[2] if row[-1] != -1 else 0.0)
+
+    def get(self, verification_key: bytes):
+        """Returns (confirmed, reserved)."""
+        confirmed, reserved = self.balances.get(verification_key, (0.0, 0.0))
+        return confirmed, reserved
 
 
 class UTXOSet:
     """
     UTXOSet class to be aggregated in SanchainCore
+    Reads are served from an in-memory cache, additions and removals are
+    written back in batches by flush().
     """
 
-    def __init__(self, path: pathlib.Path) -> None:
-        self.path = path
+    def __init__(self, storage: Storage, cache_budget: int = 64 * 1024 * 1024) -> None:
+        self.storage = storage
+        self.cache = UTXOCache(cache_budget)
+        self.balances: BalanceIndex | None = None  # built on first use
+        self.__data_version = storage.data_version()
 
-    def add_utxo(self, utxo: UTXO):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
-                utxo.to_db_row()
+    def __check_external_changes(self):
+        # another connection (e.g. a wallet process) wrote to the database
+        version = self.storage.data_version()
+        if version != self.__data_version:
+            self.cache.clear()
+            self.balances = None
+            self.__data_version = version
+
+    def __stored_row(self, uid: int):
+        """The current row of a UTXO, including unwritten changes."""
+        if uid in self.cache.removed:
+            return None
+        row = self.cache.rows.get(uid)
+        if row is None:
+            row = self.storage.fetchone(
+                "SELECT * FROM utxos WHERE uid = ?", (uid,))
+        return row
+
+    def __replace_balance(self, old_row, new_row):
+        if self.balances is None:
+            return
+        if old_row:
+            self.balances.remove(old_row)
+        if new_row:
+            self.balances.add(new_row)
+
+    def flush(self):
+        """Writes the dirty cache entries to the utxos table."""
+        if not self.cache.dirty and not self.cache.removed:
+            return
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+                [self.cache.rows[uid] for uid in self.cache.dirty]
+            )
+            conn.executemany(
+                "DELETE FROM utxos WHERE uid = ?",
+                [(uid,) for uid in self.cache.removed]
             )
-            conn.commit()
+        self.cache.dirty.clear()
+        self.cache.removed.clear()
+
+    def invalidate(self):
+        """Drops the whole cache including unwritten changes,
+        e.g. after the transaction they were flushed in was rolled back."""
+        self.cache = UTXOCache(self.cache.budget)
+        self.balances = None
+        self.__data_version = self.storage.data_version()
+
+    def add_utxo(self, utxo: UTXO):
+        self.update_utxo(utxo)
 
     def remove_utxo(self, utxo: UTXO):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"DELETE FROM utxos WHERE uid = {utxo.uid}")
-            conn.commit()
+        if self.balances is not None:
+            self.__replace_balance(self.__stored_row(utxo.uid), None)
+        self.cache.remove(utxo.uid)
 
     def update_utxo(self, utxo: UTXO):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"UPDATE utxos SET {', '.join([f'{column[0]} = ?' for column in UTXO.db_columns])} WHERE uid = {utxo.uid}",
+        row = UTXOCache.row(utxo)
+        if self.balances is not None:
+            self.__replace_balance(self.__stored_row(utxo.uid), row)
+        self.cache.put(row, dirty=True)
+
+    def set_spender(self, utxos: list[UTXO], spender_transaction_uid: int):
+        """Reserves the UTXOs for a transaction, or frees them with -1.
+        Only the spender column is taken from the arguments."""
+        self.set_spenders({utxo.uid: spender_transaction_uid for utxo in utxos})
+
+    def set_spenders(self, spenders: dict[int, int]):
+        """Sets the spender of many UTXOs at once, as {UTXO uid: spender uid}."""
+        self.__check_external_changes()
+        self.flush()  # the update below must see staged UTXOs
+        if self.balances is not None:
+            for uid, spender in spenders.items():
+                row = self.__stored_row(uid)
+                if row:
+                    self.__replace_balance(row, row[:-1] + (spender,))
+
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                "UPDATE utxos SET spender_transaction_uid = ? WHERE uid = ?",
+                [(spender, uid) for uid, spender in spenders.items()]
             )
+        for uid, spender in spenders.items():
+            row = self.cache.rows.get(uid)
+            if row is not None:
+                self.cache.put(row[:-1] + (spender,), dirty=uid in self.cache.dirty)
 
     def fetch_by_hash(self, hash: bytes):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                f"SELECT * FROM utxos WHERE transaction_hash = {hash}")
-            rows = cursor.fetchall()
-            return [UTXO.from_db_row(row) for row in rows]
+        self.__check_external_changes()
+        self.flush()
+        rows = self.storage.fetchall(
+            "SELECT * FROM utxos WHERE transaction_hash = ?", (hash,))
+        for row in rows:
+            self.cache.put(row)
+        return [UTXO.from_db_row(row) for row in rows]
 
     def fetch_by_owner(self, verification_key: bytes, unused: bool = False):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            if unused:
-                cursor.execute(
-                    "SELECT * FROM utxos WHERE verification_key = ? AND spender_transaction_uid = -1",
-                    verification_key,
-                )
-            else:
-                cursor.execute(
-                    "SELECT * FROM utxos WHERE verification_key = ?",
-                    verification_key,
-                )
-
-            rows = cursor.fetchall()
-            return [UTXO.from_db_row(row) for row in rows]
+        self.__check_external_changes()
+        rows = self.cache.get_owner(verification_key)
+        if rows is None:
+            self.flush()
+            rows = self.storage.fetchall(
+                "SELECT * FROM utxos WHERE verification_key = ?",
+                (verification_key,),
+            )
+            self.cache.put_owner(verification_key, rows)
+
+        if unused:
+            rows = [row for row in rows if row[-1] == -1]
+        return [UTXO.from_db_row(row) for row in rows]
 
     def fetch_by_uid(self, uid: int):
-        with sqlite3.connect(self.path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT * FROM utxos WHERE uid = {uid}")
-            row = cursor.fetchone()
+        self.__check_external_changes()
+        found, row = self.cache.get(uid)
+        if not found:
+            row = self.storage.fetchone(
+                "SELECT * FROM utxos WHERE uid = ?", (uid,))
             if row:
-                return UTXO.from_db_row(row)
-            return None
+                self.cache.put(row)
+        if row:
+            return UTXO.from_db_row(row)
+        return None
+
+    def fetch_by_uids(self, uids: list[int]):
+        """Returns {uid: UTXO} of the UTXOs found, the ones that are not
+        cached are fetched with Storage.fetch_in."""
+        self.__check_external_changes()
+        rows = {}
+        missing = []
+        for uid in uids:
+            found, row = self.cache.get(uid)
+            if not found:
+                missing.append(uid)
+            elif row:
+                rows[uid] = row
+        for row in self.storage.fetch_in('utxos', 'uid', missing):
+            self.cache.put(row)
+            rows[row[0]] = row
+        return {uid: UTXO.from_db_row(row) for uid, row in rows.items()}
+
+    def balance(self, verification_key: bytes):
+        """Returns the (confirmed, reserved) balance of an owner.
+        The index is built with one aggregate query and then maintained
+        incrementally, so lookups don't touch the database."""
+        self.__check_external_changes()
+        if self.balances is None:
+            self.flush()
+            self.balances = BalanceIndex(self.storage.fetchall(
+                "SELECT verification_key, SUM(value), "
+                "SUM(CASE WHEN spender_transaction_uid != -1 THEN value ELSE 0.0 END) "
+                "FROM utxos GROUP BY verification_key"
+            ))
+        return self.balances.get(verification_key)
+
+    def cache_stats(self):
+        """Hit/miss counters and memory use of the UTXO cache."""
+        return self.cache.stats()
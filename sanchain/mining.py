@@ -0,0 +1,145 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import time
+from abc import ABC, abstractmethod
+
+
+NONCE_SPACE = 2 ** 63  # packed into 8 bytes, stored as a signed SQLite INTEGER
+
+
+class MiningReport:
+    """Statistics of a finished nonce search."""
+
+    def __init__(self, hashes: int, elapsed: float, workers: int) -> None:
+        self.hashes = hashes
+        self.elapsed = elapsed
+        self.workers = workers
+
+    @property
+    def hashrate(self):
+        """Hashes per second over all workers."""
+        if self.elapsed <= 0:
+            return float(self.hashes)
+        return self.hashes / self.elapsed
+
+    def __repr__(self) -> str:
+        return f"<MiningReport {self.hashes} hashes in {self.elapsed:.2f}s ({self.hashrate:,.0f} H/s, {self.workers} workers)>"
+
+
+class MiningEngine(ABC):
+    """Searches the nonce space for a hash that satisfies the difficulty.
+    Every engine returns the same (hash, nonce) pair as Block.mine expects
+    and leaves the statistics of the last search in self.report."""
+
+    def __init__(self) -> None:
+        self.report: MiningReport | None = None
+
+    @abstractmethod
+    def search(self, block_data: bytes, difficulty: int) -> tuple[bytes, int]:
+        """Find a nonce such that sha256(block_data + nonce) starts with
+        `difficulty` zero characters. block_data is hashed only once."""
+
+
+def _scan(midstate, proof: bytes, nonce: int, count: int):
+    """Hashes `count` consecutive nonces starting at `nonce` on copies of
+    `midstate`, the hash state after the data that precedes the nonce.
+    Returns (hash, nonce) of the first match or None."""
+    for _ in range(count):
+        attempt = midstate.copy()
+        attempt.update(nonce.to_bytes(8, 'little'))
+        hash = attempt.digest()
+        if hash.startswith(proof):
+            return hash, nonce
+        nonce = (nonce + 1) % NONCE_SPACE
+    return None
+
+
+class SerialEngine(MiningEngine):
+    """Single core nonce search."""
+
+    batch_size = 4096
+
+    def search(self, block_data: bytes, difficulty: int):
+        proof = b'0' * difficulty
+        midstate = hashlib.sha256(block_data)
+        nonce = random.randrange(NONCE_SPACE)
+        hashes = 0
+        start = time.perf_counter()
+        while True:
+            found = _scan(midstate, proof, nonce, self.batch_size)
+            if found:
+                hashes += (found[1] - nonce) % NONCE_SPACE + 1
+                break
+            hashes += self.batch_size
+            nonce = (nonce + self.batch_size) % NONCE_SPACE
+
+        self.report = MiningReport(hashes, time.perf_counter() - start, 1)
+        return found
+
+
+def _worker(block_data: bytes, proof: bytes, nonce: int, batch_size: int, stop, results):
+    # hash objects can't be pickled, so every worker builds its own midstate
+    midstate = hashlib.sha256(block_data)
+    hashes = 0
+    found = None
+    while not stop.is_set():
+        found = _scan(midstate, proof, nonce, batch_size)
+        if found:
+            hashes += (found[1] - nonce) % NONCE_SPACE + 1
+            stop.set()
+            break
+        hashes += batch_size
+        nonce = (nonce + batch_size) % NONCE_SPACE
+    results.put((found, hashes))
+
+
+class ParallelEngine(MiningEngine):
+    """Splits the nonce space into contiguous ranges, one per worker process.
+    The first worker to find a valid hash stops the others."""
+
+    batch_size = 4096
+
+    def __init__(self, workers: int | None = None) -> None:
+        super().__init__()
+        self.workers = workers or os.cpu_count() or 1
+
+    def search(self, block_data: bytes, difficulty: int):
+        proof = b'0' * difficulty
+        offset = random.randrange(NONCE_SPACE)
+        chunk = NONCE_SPACE // self.workers
+
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_worker,
+                args=(block_data, proof, (offset + i * chunk) % NONCE_SPACE,
+                      self.batch_size, stop, results),
+                daemon=True,
+            )
+            for i in range(self.workers)
+        ]
+
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+
+        winner = None
+        hashes = 0
+        try:
+            # every worker reports exactly once, whether it won or was stopped
+            for _ in processes:
+                found, count = results.get()
+                hashes += count
+                if found and not winner:
+                    winner = found
+        finally:
+            stop.set()
+            for process in processes:
+                process.join()
+
+        self.report = MiningReport(
+            hashes, time.perf_counter() - start, self.workers)
+        return winner
@@ -1,4 +1,6 @@
 from .transaction import Transaction
 from .account import Account
-from .block import Block, BlockReward
-from .utxo import UTXO
+from .block import Block, BlockHeader, BlockReward
+from .utxo import UTXO, UTXOBatch
+from .merkle import MerkleTree
+from . import keys
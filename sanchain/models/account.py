@@ -3,6 +3,7 @@ import base64
 import json
 
 from ..base import AbstractBroadcastModel
+from . import keys
 
 
 class Account(AbstractBroadcastModel):
@@ -13,8 +14,7 @@ class Account(AbstractBroadcastModel):
     def __init__(self, public_key: rsa.PublicKey, private_key: rsa.PrivateKey) -> None:
         self.public_key = public_key
         self.private_key = private_key
-        self.verification_key = rsa.compute_hash(
-            public_key.save_pkcs1("DER"), "SHA-256"),
+        self.verification_key = keys.verification_key(public_key)
 
     @classmethod
     def new(cls):
@@ -23,8 +23,7 @@ class Account(AbstractBroadcastModel):
     @classmethod
     def from_json(cls, json_data: dict):
         return cls(
-            rsa.PublicKey.load_pkcs1(base64.b64decode(
-                json_data['public_key']), format="DER"),
+            keys.from_b64(json_data['public_key']),
             rsa.PrivateKey.load_pkcs1(base64.b64decode(
                 json_data['private_key']), format="DER"),
         )
@@ -36,7 +35,7 @@ class Account(AbstractBroadcastModel):
 
     def to_json(self):
         return {
-            'public_key': base64.b64encode(self.public_key.save_pkcs1("DER")).decode(),
+            'public_key': keys.b64(self.public_key),
             'private_key': base64.b64encode(self.private_key.save_pkcs1("DER")).decode()
         }
 
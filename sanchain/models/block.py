@@ -1,15 +1,55 @@
 import rsa
 import time
-import random
-import json
 import base64
 import sqlite3
+import struct
+import hashlib
+from concurrent.futures import Executor
 
 from ..config import SanchainConfig
+from ..mining import MiningEngine, SerialEngine
 from .transaction import Transaction, BlockReward
+from .merkle import MerkleTree
 from ..base import AbstractSanchainModel
 
 
+class BlockHeader:
+    """Fixed size summary of a block that the proof of work commits to.
+    The transactions are covered through the merkle root."""
+
+    # idx, timestamp, previous block hash, merkle root, difficulty
+    # the 8 byte nonce is appended after the prefix
+    prefix_format = struct.Struct('<qq32s32sI')
+
+    def __init__(self, idx: int, timestamp: int, previous_hash: bytes, merkle_root: bytes, difficulty: int, nonce: int) -> None:
+        self.idx = idx
+        self.timestamp = timestamp
+        self.previous_hash = previous_hash
+        self.merkle_root = merkle_root
+        self.difficulty = difficulty
+        self.nonce = nonce
+
+    def prefix(self):
+        """The header without the nonce."""
+        return self.prefix_format.pack(
+            self.idx,
+            self.timestamp,
+            self.previous_hash,
+            self.merkle_root,
+            self.difficulty,
+        )
+
+    def pack(self):
+        return self.prefix() + self.nonce.to_bytes(8, 'little')
+
+    def calculate_hash(self):
+        return hashlib.sha256(self.pack()).digest()
+
+    def has_valid_proof(self, hash: bytes):
+        """Checks that `hash` belongs to this header and meets the difficulty."""
+        return hash.startswith(b'0' * self.difficulty) and hash == self.calculate_hash()
+
+
 class Block(AbstractSanchainModel):
     """
     Use Block.new() to create a new block for mining.
@@ -42,6 +82,7 @@ class Block(AbstractSanchainModel):
         self.hash = hash
         self.nonce = nonce
         self.invalid_transactions = []
+        self.__merkle_tree = None
 
     @classmethod
     def new(cls, transactions: list[Transaction], config: SanchainConfig):
@@ -49,7 +90,8 @@ class Block(AbstractSanchainModel):
             config.last_block_index + 1,
             0,
             b'',
-            config,
+            # a copy, as the core's config is updated when the block is added
+            SanchainConfig.from_json(config.to_json(), ''),
             transactions,
             b'',
             0,
@@ -58,10 +100,12 @@ class Block(AbstractSanchainModel):
     @classmethod
     def from_json(cls, json_data):
         return cls(
+            json_data['idx'],
             json_data['timestamp'],
             base64.b64decode(json_data['merkle_root'].encode()),
-            SanchainConfig.from_json(json_data['config']),
-            [Transaction.from_json(transaction)
+            # the config of a block is not tied to a local core
+            SanchainConfig.from_json(json_data['config'], ''),
+            [(BlockReward if transaction['type'] == BlockReward.model_type else Transaction).from_json(transaction)
              for transaction in json_data['transactions']],
             base64.b64decode(json_data['hash'].encode()),
             json_data['nonce'],
@@ -69,29 +113,21 @@ class Block(AbstractSanchainModel):
 
     @classmethod
     def from_db_row(cls, row):
+        """The block without its transactions, see SanchainCore.get_block."""
         return cls(
             row[0],
             row[1],
             row[2],
-            SanchainConfig(
-                row[5],
-                row[6],
-                row[7],
-                row[8],
-                row[9],
-                row[10],
-                row[11],
-                row[12],
-                row[13],
-            ),
-            [],  # TODO: load transactions from database
+            # the config of a block is not tied to a local core
+            SanchainConfig('', *row[5:14]),
+            [],
             row[3],
             row[4],
-
         )
 
     def to_json(self):
         return {
+            'type': self.model_type,
             'idx': self.idx,
             'timestamp': self.timestamp,
             'merkle_root': base64.b64encode(self.merkle_root).decode(),
@@ -120,6 +156,16 @@ class Block(AbstractSanchainModel):
             self.config.circulation,
         )
 
+    def header(self):
+        return BlockHeader(
+            self.idx,
+            self.timestamp,
+            self.config.last_block_hash,
+            self.merkle_root,
+            self.config.difficulty,
+            self.nonce,
+        )
+
     def hashable(self):
         return {
             'idx': self.idx,
@@ -129,41 +175,65 @@ class Block(AbstractSanchainModel):
             'config': self.config.to_json(),
         }
 
-    def __calculate_merkle_root(self):
-        nodes = [transaction.hash for transaction in self.transactions]
-
-        while len(nodes) > 1:
+    def merkle_tree(self):
+        """The merkle tree of the transaction hashes. It is kept between
+        calls and only the paths of changed or added transactions are rehashed."""
+        hashes = [transaction.hash for transaction in self.transactions]
+        if self.__merkle_tree is None:
+            self.__merkle_tree = MerkleTree(hashes)
+        else:
+            self.__merkle_tree.update(hashes)
+        return self.__merkle_tree
+
+    def merkle_proof(self, transaction: Transaction):
+        """Proof that the transaction is part of this block, to be checked
+        with MerkleTree.verify(transaction.hash, proof, block.merkle_root)."""
+        return self.merkle_tree().proof(self.transactions.index(transaction))
 
-            new_nodes = []
-
-            for i in range(0, len(nodes), 2):
-                try:
-                    new_nodes.append(rsa.compute_hash(
-                        nodes[i] + nodes[i + 1], 'SHA-256'))
-                except IndexError:
-                    new_nodes.append(rsa.compute_hash(nodes[i], 'SHA-256'))
-
-            nodes = new_nodes
-
-        return nodes[-1]
-
-    def __calculate_hash(self, block_data: bytes):
-        nonce = random.randint(0, 99999999999999999)
-        proof = b'0' * self.config.difficulty
-        hash = b''
-        while not hash.startswith(proof):
-            nonce += 1
-            hash = rsa.compute_hash(block_data +
-                                    nonce.to_bytes(8, 'little'), 'SHA-256')
-        return hash, nonce
-
-    def mine(self, miner: rsa.PublicKey):
+    def __calculate_merkle_root(self):
+        return self.merkle_tree().root
+
+    def __calculate_hash(self, header_prefix: bytes, engine: MiningEngine):
+        # the header is fixed size, so the cost of an attempt does not
+        # depend on the number of transactions in the block
+        return engine.search(header_prefix, self.config.difficulty)
+
+    def validate(self, config: SanchainConfig, executor: Executor | None = None):
+        """Validates a block received from the network against the local config:
+        its position in the chain, proof of work, merkle root and transactions."""
+        # the header does not commit to the config of the block, so it must
+        # be the local config as it is before the block and is never trusted
+        if self.idx != config.last_block_index + 1 \
+                or self.config.to_db_row() != config.to_db_row():
+            return False
+
+        if not self.header().has_valid_proof(self.hash):
+            return False
+
+        if not self.transactions or self.merkle_root != self.__calculate_merkle_root():
+            return False
+
+        # last transaction is the reward transaction
+        *transactions, reward = self.transactions
+        if reward.sender != config.REWARD_SENDER.public_key or reward.amount != config.reward:
+            return False
+
+        return all(Transaction.verify_many(transactions, config, executor))
+
+    def mine(self, miner: rsa.PublicKey, engine: MiningEngine | None = None, executor: Executor | None = None):
+        """Verifies the transactions, adds the block reward and searches for the nonce.
+        Pass a ParallelEngine to use more than one core for the nonce search
+        and a ProcessPoolExecutor to verify the signatures in parallel."""
+        if engine is None:
+            engine = SerialEngine()
 
         self.timestamp = int(time.time())
 
         # verify and execute transactions
-        for transaction in self.transactions:
-            if transaction.verify(self.config):
+        verdicts = Transaction.verify_many(
+            self.transactions, self.config, executor)
+        for transaction, is_valid in zip(self.transactions, verdicts):
+            if is_valid:
                 transaction.execute(miner, self.config)
             else:
                 self.invalid_transactions.append(transaction)
@@ -176,10 +246,7 @@ class Block(AbstractSanchainModel):
         # calculate merkle hash
         self.merkle_root = self.__calculate_merkle_root()
 
-        block = self.hashable()
-
-        block_data = json.dumps(block).encode()
-        hash, nonce = self.__calculate_hash(block_data)
+        hash, nonce = self.__calculate_hash(self.header().prefix(), engine)
 
         self.hash = hash
         self.nonce = nonce
@@ -0,0 +1,41 @@
+import base64
+import hashlib
+from functools import lru_cache
+
+import rsa
+
+
+# Encoding and parsing a public key goes through pyasn1 and costs more than
+# the rest of serializing a transaction, while a chain only has a limited
+# number of distinct keys. Each key is parsed once and its encodings are
+# computed once, the functions below return the memoized values.
+CACHE_SIZE = 100_000
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def der(key: rsa.PublicKey) -> bytes:
+    return key.save_pkcs1("DER")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def b64(key: rsa.PublicKey) -> str:
+    """Base64 of the DER encoding, as used in JSON and database rows."""
+    return base64.b64encode(der(key)).decode()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def verification_key(key: rsa.PublicKey) -> bytes:
+    """SHA-256 of the DER encoding, the owner of a UTXO."""
+    return hashlib.sha256(der(key)).digest()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def from_der(data: bytes) -> rsa.PublicKey:
+    """Parses a key. The same key object is returned for the same bytes,
+    so the encodings above are found in their caches."""
+    return rsa.PublicKey.load_pkcs1(data, format="DER")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def from_b64(data: str | bytes) -> rsa.PublicKey:
+    return from_der(base64.b64decode(data))
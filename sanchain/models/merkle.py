@@ -0,0 +1,112 @@
+import hashlib
+
+
+def _hash(data: bytes):
+    return hashlib.sha256(data).digest()
+
+
+class MerkleTree:
+    """
+    Merkle tree over transaction hashes that keeps every level, so that
+    appending or replacing a leaf only rehashes its path to the root.
+    Pairs of nodes are hashed together, a node without a sibling is
+    hashed alone, and a single leaf is its own root.
+
+    proof() returns the path of a leaf to the root, which verify() checks
+    against a block's merkle root without the other transactions.
+    """
+
+    def __init__(self, leaves: list[bytes] | None = None) -> None:
+        self.levels = [[]]  # leaves first, the root last
+        for leaf in leaves or []:
+            self.levels[0].append(leaf)
+        self.__rebuild()
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def leaves(self):
+        return self.levels[0]
+
+    @property
+    def root(self):
+        """The merkle root, b'' for an empty tree."""
+        return self.levels[-1][0] if self.levels[0] else b''
+
+    @staticmethod
+    def __parent(level: list[bytes], i: int):
+        """Hash of the parent of the nodes 2i and 2i + 1."""
+        if 2 * i + 1 < len(level):
+            return _hash(level[2 * i] + level[2 * i + 1])
+        return _hash(level[2 * i])
+
+    def __rebuild(self):
+        del self.levels[1:]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            self.levels.append([self.__parent(level, i) for i in range((len(level) + 1) // 2)])
+
+    def __update(self, i: int):
+        """Rehashes the path from leaf i to the root."""
+        depth = 0
+        while len(self.levels[depth]) > 1:
+            i //= 2
+            parent = self.__parent(self.levels[depth], i)
+            if depth + 1 == len(self.levels):
+                self.levels.append([])
+            above = self.levels[depth + 1]
+            if i == len(above):
+                above.append(parent)
+            else:
+                above[i] = parent
+            depth += 1
+        # the tree only grows, there's nothing left above the root
+        del self.levels[depth + 1:]
+
+    def append(self, leaf: bytes):
+        self.levels[0].append(leaf)
+        self.__update(len(self.levels[0]) - 1)
+
+    def replace(self, i: int, leaf: bytes):
+        self.levels[0][i] = leaf
+        self.__update(i)
+
+    def update(self, leaves: list[bytes]):
+        """Makes the leaves equal to `leaves`, rehashing only the paths of
+        the leaves that changed or were added."""
+        if len(leaves) < len(self.levels[0]):
+            self.levels[0] = list(leaves)
+            self.__rebuild()
+            return
+        for i, leaf in enumerate(leaves):
+            if i == len(self.levels[0]):
+                self.append(leaf)
+            elif self.levels[0][i] != leaf:
+                self.replace(i, leaf)
+
+    def proof(self, i: int):
+        """Path from leaf i to the root as (sibling, sibling is left) pairs.
+        sibling is None where the node was hashed alone."""
+        path = []
+        for level in self.levels[:-1]:
+            sibling = i ^ 1
+            if sibling < len(level):
+                path.append((level[sibling], sibling < i))
+            else:
+                path.append((None, False))
+            i //= 2
+        return path
+
+    @staticmethod
+    def verify(leaf: bytes, proof: list[tuple], root: bytes):
+        """Checks that `leaf` is part of the tree with the root `root`."""
+        node = leaf
+        for sibling, is_left in proof:
+            if sibling is None:
+                node = _hash(node)
+            elif is_left:
+                node = _hash(sibling + node)
+            else:
+                node = _hash(node + sibling)
+        return node == root
@@ -2,14 +2,79 @@ import rsa
 import base64
 import json
 import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
 
 from ..utils import uid
 from ..config import SanchainConfig
 from ..base import AbstractSanchainModel
 from .utxo import UTXO
+from . import keys
 # from ..core import SanchainCore
 
 
+def _verify_signature(message: bytes, signature: bytes, public_key: rsa.PublicKey):
+    """Module level so that it can be sent to worker processes."""
+    try:
+        rsa.verify(message, signature, public_key)
+    except rsa.VerificationError:
+        return False
+    return True
+
+
+class SignatureCache:
+    """Bounded LRU record of transactions whose signature has been verified,
+    keyed by (uid, signature, sha256 of the signable data), so that a
+    transaction is not checked again at block assembly or block receipt.
+    It is shared by the threads that verify transactions, e.g. the stages of
+    the Pipeline, so the entries are only touched under a lock."""
+
+    def __init__(self, maxsize: int = 100_000) -> None:
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.verifications = 0  # signatures that had to be checked with RSA
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True
+            return False
+
+    def add(self, key):
+        with self.lock:
+            self.entries[key] = None
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def record(self, key, is_signed: bool):
+        """Counts a signature checked with RSA and keeps it if it is valid."""
+        with self.lock:
+            self.verifications += 1
+        if is_signed:
+            self.add(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.verifications
+        return {
+            'hits': self.hits,
+            'verifications': self.verifications,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+
 class Transaction(AbstractSanchainModel):
     """Transaction that can be signed and will be broadcasted
     to the mempool.
@@ -19,6 +84,10 @@ class Transaction(AbstractSanchainModel):
     A verified transaction will be hashed and new UTXOs will be generated.
     """
 
+    __slots__ = ('uid', 'sender', 'receiver', 'amount', 'utxos', 'signature',
+                 'nascent_utxos', 'hash', 'block_index', '__is_verified',
+                 '__signable')
+
     db_columns = [
         ('uid', 'INTEGER PRIMARY KEY'),
         ('sender', 'BLOB'),
@@ -29,6 +98,11 @@ class Transaction(AbstractSanchainModel):
         ('block_index', 'INTEGER'),
     ]
 
+    # smaller batches are verified in process, sending them to workers
+    # costs more than the RSA checks
+    min_parallel_batch = 16
+    signature_cache = SignatureCache()
+
     def __init__(self, uid: int, sender: rsa.PublicKey, receiver: rsa.PublicKey, amount: float, utxos: list[UTXO], signature: bytes, nascent_utxos: list[UTXO], hash: bytes, block_index: int) -> None:
         self.uid = uid
         self.sender = sender
@@ -43,6 +117,7 @@ class Transaction(AbstractSanchainModel):
         self.block_index = block_index
 
         self.__is_verified = False
+        self.__signable = None  # (fingerprint, message, digest)
 
     @classmethod
     def unsigned(cls, sender: rsa.PublicKey, receiver: rsa.PublicKey, amount: float, utxos: list[UTXO]):
@@ -52,26 +127,23 @@ class Transaction(AbstractSanchainModel):
     def from_db_row(cls, row):
         obj = cls(
             row[0],
-            rsa.PublicKey.load_pkcs1(base64.b64decode(row[1]), format="DER"),
-            rsa.PublicKey.load_pkcs1(base64.b64decode(row[2]), format="DER"),
+            keys.from_b64(row[1]),
+            keys.from_b64(row[2]),
             float(row[3]),
-            row[-2],  # use uid to fetch the UTXOs from the database
+            row[-2],  # input utxos, fetched by the caller via the uid
             row[4],
-            row[-1],  # use hash to fetch the UTXOs from the database
+            row[-1],  # output utxos, fetched by the caller via the hash
             row[5],
             row[6],
         )
-        # TODO: fetch the UTXOs from the database
         return obj
 
     @classmethod
     def from_json(cls, json_data):
         return cls(
             json_data['uid'],
-            rsa.PublicKey.load_pkcs1(base64.b64decode(
-                json_data['sender']), format="DER"),
-            rsa.PublicKey.load_pkcs1(base64.b64decode(
-                json_data['receiver']), format="DER"),
+            keys.from_b64(json_data['sender']),
+            keys.from_b64(json_data['receiver']),
             float(json_data['amount']),
             [UTXO.from_json(utxo) for utxo in json_data['utxos']],
             base64.b64decode(json_data['signature']),
@@ -83,8 +155,8 @@ class Transaction(AbstractSanchainModel):
     def to_db_row(self):
         return (
             self.uid,
-            sqlite3.Binary((base64.b64encode(self.sender.save_pkcs1("DER")))),
-            sqlite3.Binary(base64.b64encode(self.receiver.save_pkcs1("DER"))),
+            sqlite3.Binary(keys.b64(self.sender).encode()),
+            sqlite3.Binary(keys.b64(self.receiver).encode()),
             float(self.amount),
             sqlite3.Binary(self.signature),
             sqlite3.Binary(self.hash),
@@ -95,8 +167,8 @@ class Transaction(AbstractSanchainModel):
         return {
             'type': self.model_type,
             'uid': self.uid,
-            'sender': base64.b64encode(self.sender.save_pkcs1("DER")).decode(),
-            'receiver': base64.b64encode(self.receiver.save_pkcs1("DER")).decode(),
+            'sender': keys.b64(self.sender),
+            'receiver': keys.b64(self.receiver),
             'amount': float(self.amount),
             'signature': base64.b64encode(self.signature).decode(),
             'utxos': [utxo.to_json() for utxo in self.utxos],
@@ -121,48 +193,91 @@ class Transaction(AbstractSanchainModel):
         data['utxos'] = utxo_without_spender
         return data
 
+    def __fingerprint(self):
+        """The values that the signable data is built from."""
+        return (self.model_type, self.uid, self.sender, self.receiver, self.amount,
+                *[(utxo.uid, utxo.verification_key, utxo.value, utxo.idx,
+                   utxo.transaction_hash, utxo.block_index) for utxo in self.utxos])
+
+    def signable_bytes(self):
+        """The encoding of signable() that is signed and verified. It is
+        computed once and kept until a value it is built from changes."""
+        fingerprint = self.__fingerprint()
+        if self.__signable is None or self.__signable[0] != fingerprint:
+            # the key order of to_json is fixed, so the encoding is stable
+            message = json.dumps(self.signable()).encode()
+            self.__signable = (fingerprint, message,
+                               hashlib.sha256(message).digest())
+        return self.__signable[1]
+
+    def signable_digest(self):
+        """SHA-256 of signable_bytes()."""
+        self.signable_bytes()
+        return self.__signable[2]
+
+    def calculate_hash(self):
+        """SHA-256 of the encoding of the transaction, as done once by
+        execute() after the outputs are created."""
+        return hashlib.sha256(json.dumps(self.to_json()).encode()).digest()
+
     def sign(self, private_key: rsa.PrivateKey):
         # at this point, the transaction will contain only the
         # sender, receiver, amount and utxos
         # so remove everything else and sign the transaction
         # when verifying, remove everything else and verify the signature
 
-        data = self.signable()
-
         self.signature = rsa.sign(
-            json.dumps(data).encode(),
+            self.signable_bytes(),
             private_key,
             'SHA-256'
         )
 
+    def __check_utxos(self, config: SanchainConfig, verification_key: bytes):
+        """Checks that the sender owns the utxos and that they cover the amount."""
+        # TODO: verify the utxos from the blockchain by backtracking
+        return all(utxo.verification_key == verification_key for utxo in self.utxos) \
+            and sum([utxo.value for utxo in self.utxos]) >= (
+                self.amount + self.amount * config.miner_fees)
+
     def verify(self, config: SanchainConfig):
         """Verify the transaction and its utxos."""
-        try:
-            data = self.signable()
-
-            rsa.verify(
-                json.dumps(data).encode(),
-                self.signature,
-                self.sender
-            )
+        return self.verify_many([self], config)[0]
 
-            # verify the utxos
-            for utxo in self.utxos:
-                assert utxo.verification_key == rsa.compute_hash(
-                    self.sender.save_pkcs1("DER"), "SHA-256")
-
-            # TODO: verify the utxos from the blockchain by backtracking
+    @classmethod
+    def verify_many(cls, transactions: list['Transaction'], config: SanchainConfig, executor: Executor | None = None):
+        """Verify a batch of transactions and return a verdict for each one.
+        Signatures found in the signature cache are not checked again. With an executor, e.g. a
+        ProcessPoolExecutor, the remaining signatures are checked in parallel."""
+        signed = []
+        pending = []  # (position, cache key, message) of uncached signatures
+        for i, transaction in enumerate(transactions):
+            message = transaction.signable_bytes()
+            key = (transaction.uid, transaction.signature,
+                   transaction.signable_digest())
+            signed.append(key in cls.signature_cache)
+            if not signed[-1]:
+                pending.append((i, key, message))
+
+        messages = [message for _, _, message in pending]
+        signatures = [transactions[i].signature for i, _, _ in pending]
+        senders = [transactions[i].sender for i, _, _ in pending]
+        if executor is not None and len(pending) >= cls.min_parallel_batch:
+            results = executor.map(
+                _verify_signature, messages, signatures, senders,
+                chunksize=max(1, len(pending) // 64))
+        else:
+            results = map(_verify_signature, messages, signatures, senders)
 
-            # verify the balance
-            assert sum([utxo.value for utxo in self.utxos]) >= (
-                self.amount + self.amount * config.miner_fees), "Insufficient balance"
+        for (i, key, _), is_signed in zip(pending, results):
+            cls.signature_cache.record(key, is_signed)
+            signed[i] = is_signed
 
-        except (rsa.VerificationError, KeyError, AssertionError):
-            self.__is_verified = False
-            return False
-        else:
-            self.__is_verified = True
-            return True
+        verdicts = []
+        for transaction, is_signed in zip(transactions, signed):
+            transaction.__is_verified = is_signed and transaction.__check_utxos(
+                config, keys.verification_key(transaction.sender))
+            verdicts.append(transaction.__is_verified)
+        return verdicts
 
     def execute(self, miner: rsa.PublicKey, config: SanchainConfig):
         """Complete a transaction by creating new outputs as NascentUTXOs.
@@ -175,13 +290,13 @@ class Transaction(AbstractSanchainModel):
 
         self.nascent_utxos = [
             UTXO.nascent(  # miner's fees
-                rsa.compute_hash(miner.save_pkcs1("DER"), "SHA-256"),
+                keys.verification_key(miner),
                 self.amount * config.miner_fees,
                 0,
                 self.block_index,
             ),
             UTXO.nascent(  # receiver's utxo
-                rsa.compute_hash(self.receiver.save_pkcs1("DER"), "SHA-256"),
+                keys.verification_key(self.receiver),
                 self.amount,
                 1,
                 self.block_index,
@@ -194,7 +309,7 @@ class Transaction(AbstractSanchainModel):
         if change > 0:
             self.nascent_utxos.append(  # sender's change
                 UTXO.nascent(
-                    rsa.compute_hash(self.sender.save_pkcs1("DER"), "SHA-256"),
+                    keys.verification_key(self.sender),
                     change,
                     2,
                     self.block_index,
@@ -202,8 +317,7 @@ class Transaction(AbstractSanchainModel):
             )
 
         # hash the transaction
-        self.hash = rsa.compute_hash(json.dumps(
-            self.to_json()).encode(), "SHA-256")
+        self.hash = self.calculate_hash()
 
         for utxo in self.nascent_utxos:
             utxo.transaction_hash = self.hash
@@ -214,6 +328,8 @@ class BlockReward(Transaction):
     Use BlockReward.new() to create a new block reward transaction as a miner.
     """
 
+    __slots__ = ()
+
     @classmethod
     def new(cls, miner: rsa.PublicKey, config: SanchainConfig):
         obj = cls(
@@ -224,7 +340,7 @@ class BlockReward(Transaction):
             [],  # input utxos
             b'',  # signature
             [UTXO.nascent(
-                rsa.compute_hash(miner.save_pkcs1("DER"), "SHA-256"),
+                keys.verification_key(miner),
                 config.reward,
                 0,
                 config.last_block_index + 1,
@@ -232,8 +348,7 @@ class BlockReward(Transaction):
             b'',  # hash
             config.last_block_index + 1,
         )
-        obj.hash = rsa.compute_hash(json.dumps(
-            obj.to_json()).encode(), "SHA-256")
+        obj.hash = obj.calculate_hash()
         for utxo in obj.nascent_utxos:
             utxo.transaction_hash = obj.hash
         obj.sign(config.REWARD_SENDER.private_key)
@@ -1,11 +1,16 @@
 import base64
 import sqlite3
+from array import array
 
 from ..base import AbstractSanchainModel
 from ..utils import uid
 
 
 class UTXO(AbstractSanchainModel):
+    # millions of UTXOs can be held in memory, see UTXOBatch for bulk data
+    __slots__ = ('uid', 'verification_key', 'value', 'idx',
+                 'transaction_hash', 'block_index', 'spender_transaction_uid')
+
     db_columns = [
         ('uid', 'INTEGER PRIMARY KEY'),
         ('verification_key', 'BLOB'),
@@ -78,3 +83,89 @@ class UTXO(AbstractSanchainModel):
     @classmethod
     def from_db_row(cls, row):
         return cls(*row)
+
+
+class UTXOBatch:
+    """
+    Columnar container of many UTXOs: numbers are kept in typed arrays,
+    owner keys in a table of distinct keys and transaction hashes in one
+    buffer, instead of one object per UTXO. Items are built as UTXO
+    objects when accessed.
+    """
+
+    hash_size = 32  # transaction hashes are SHA-256 digests or empty
+
+    def __init__(self) -> None:
+        self.uids = array('q')
+        self.values = array('d')
+        self.idxs = array('q')
+        self.block_indexes = array('q')
+        self.spenders = array('q')
+        self.owners = array('I')  # index into keys
+        self.keys = []
+        self.__key_index = {}
+        self.hashes = bytearray()
+        self.hash_lengths = array('B')
+
+    @classmethod
+    def from_rows(cls, rows):
+        batch = cls()
+        for row in rows:
+            batch.append_row(row)
+        return batch
+
+    @classmethod
+    def from_utxos(cls, utxos: list[UTXO]):
+        return cls.from_rows(utxo.to_db_row() for utxo in utxos)
+
+    def append_row(self, row):
+        uid, verification_key, value, idx, transaction_hash, block_index, spender = row
+        verification_key, transaction_hash = bytes(verification_key), bytes(transaction_hash)
+        assert len(transaction_hash) <= self.hash_size
+        key = self.__key_index.get(verification_key)
+        if key is None:
+            key = self.__key_index[verification_key] = len(self.keys)
+            self.keys.append(verification_key)
+        self.uids.append(uid)
+        self.values.append(value)
+        self.idxs.append(idx)
+        self.block_indexes.append(block_index)
+        self.spenders.append(spender)
+        self.owners.append(key)
+        self.hashes += transaction_hash.ljust(self.hash_size, b'\0')
+        self.hash_lengths.append(len(transaction_hash))
+
+    def append(self, utxo: UTXO):
+        self.append_row(utxo.to_db_row())
+
+    def __len__(self):
+        return len(self.uids)
+
+    def row(self, i: int):
+        """The database row of item i, as UTXO().to_db_row() would return it."""
+        start = i * self.hash_size
+        return (
+            self.uids[i],
+            self.keys[self.owners[i]],
+            self.values[i],
+            self.idxs[i],
+            bytes(self.hashes[start:start + self.hash_lengths[i]]),
+            self.block_indexes[i],
+            self.spenders[i],
+        )
+
+    def rows(self):
+        return (self.row(i) for i in range(len(self)))
+
+    def __getitem__(self, i: int):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return UTXO.from_db_row(self.row(i))
+
+    def __iter__(self):
+        return (UTXO.from_db_row(row) for row in self.rows())
+
+    def total_value(self):
+        return sum(self.values)
@@ -0,0 +1,69 @@
+"""Blocks per second through SanchainCore.add_block.
+
+Run with: python -m scripts.bench_add_block
+"""
+import itertools
+import os
+import pathlib
+import tempfile
+import time
+
+from sanchain.models import Account, Block, BlockReward, Transaction, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+
+
+BLOCKS = 50
+TRANSACTIONS_PER_BLOCK = 100
+
+# utils.uid is only unique per call, not per burst of calls
+uids = itertools.count(1)
+
+
+def make_block(core: SanchainCore, spendable: list[UTXO], sender: Account, receiver: Account):
+    """A block that spends every UTXO in `spendable` and creates two new ones per input."""
+    idx = core.config.last_block_index + 1
+    transactions = []
+    for utxo in spendable:
+        txn = Transaction(next(uids), sender.public_key, receiver.public_key,
+                          1.0, [utxo], b'', [], b'', -1)
+        txn.hash = os.urandom(32)
+        txn.block_index = idx
+        txn.nascent_utxos = [
+            UTXO(next(uids), receiver.verification_key, 1.0, 1, txn.hash, idx, -1),
+            UTXO(next(uids), sender.verification_key, utxo.value - 1.0, 2, txn.hash, idx, -1),
+        ]
+        transactions.append(txn)
+
+    reward = BlockReward.new(sender.public_key, core.config)
+    reward.uid = next(uids)
+    reward.nascent_utxos[0].uid = next(uids)
+    block = Block.new(transactions + [reward], core.config)
+    block.hash = os.urandom(32)
+    block.merkle_root = os.urandom(32)
+    return block
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    core = SanchainCore.new('bench')
+    sender, receiver = Account.new(), Account.new()
+
+    # a first block funds the sender with one UTXO per transaction slot
+    spendable = [
+        UTXO(next(uids), sender.verification_key, 1000.0, i, b'', 0, -1)
+        for i in range(TRANSACTIONS_PER_BLOCK)
+    ]
+    for utxo in spendable:
+        core.utxo_set.add_utxo(utxo)
+
+    elapsed = 0.0
+    for _ in range(BLOCKS):
+        block = make_block(core, spendable, sender, receiver)
+        start = time.perf_counter()
+        core.add_block(block)
+        elapsed += time.perf_counter() - start
+        spendable = [txn.nascent_utxos[-1] for txn in block.transactions[:-1]]
+
+    print(f"{BLOCKS} blocks of {TRANSACTIONS_PER_BLOCK} transactions: "
+          f"{BLOCKS / elapsed:.1f} blocks/s ({elapsed / BLOCKS * 1000:.2f} ms/block)")
@@ -0,0 +1,94 @@
+"""Mempool admission of a burst of transactions: one Mempool.add_transaction
+call per transaction against Mempool.add_transactions batches. Signatures
+are checked beforehand (as the Pipeline does), so the signature cache is
+warm and the database work is measured.
+
+Run with: python -m scripts.bench_admission
+"""
+import pathlib
+import sqlite3
+import tempfile
+import time
+
+from sanchain.models import Account, Transaction, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+
+
+TRANSACTIONS = 2000
+BATCH_SIZES = [100, 2000]
+
+
+def make_core(name: str, transactions: list[Transaction]):
+    core = SanchainCore.new(name)
+    with sqlite3.connect(core.path) as conn:
+        conn.executemany(
+            f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+            [utxo.to_db_row() for txn in transactions for utxo in txn.utxos]
+        )
+    return core
+
+
+def one_by_one(core: SanchainCore, transactions: list[Transaction]):
+    for txn in transactions:
+        if txn.verify(core.config):
+            core.mempool.add_transaction(txn)
+
+
+def batched(core: SanchainCore, transactions: list[Transaction], size: int):
+    for i in range(0, len(transactions), size):
+        assert all(core.mempool.add_transactions(transactions[i:i + size]))
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+    transactions = []
+    for i in range(TRANSACTIONS):
+        utxo = UTXO(i, sender.verification_key, 10.0, 0, i.to_bytes(32, 'little'), 0, -1)
+        txn = Transaction(TRANSACTIONS + i, sender.public_key, receiver.public_key,
+                          1.0, [utxo], b'', [], b'', -1)
+        txn.sign(sender.private_key)
+        transactions.append(txn)
+    Transaction.verify_many(transactions, SanchainConfig.default('bench'))
+
+    runs = [('add_transaction', one_by_one)] + [
+        (f'add_transactions({size})', lambda core, txns, size=size: batched(core, txns, size))
+        for size in BATCH_SIZES]
+    print(f"{TRANSACTIONS} transactions")
+    for name, admit in runs:
+        core = make_core(name, transactions)
+        start = time.perf_counter()
+        admit(core, transactions)
+        elapsed = time.perf_counter() - start
+        assert core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0] == TRANSACTIONS
+        print(f"{name:>34} {elapsed * 1000:>9.1f} ms {TRANSACTIONS / elapsed:>10,.0f} transactions/s")
+
+    # spends of reserved inputs that pay less fees are rejected
+    def respend(transactions: list[Transaction], first_uid: int, amount: float):
+        respends = [Transaction(first_uid + i, txn.sender, receiver.public_key, amount,
+                                txn.utxos, b'', [], b'', -1) for i, txn in enumerate(transactions)]
+        for txn in respends:
+            txn.sign(sender.private_key)
+        Transaction.verify_many(respends, SanchainConfig.default('bench'))
+        return respends
+
+    cheaper = respend(transactions, 2 * TRANSACTIONS, 0.5)
+    for name, reject in [('add_transaction', lambda core: [core.mempool.add_transaction(txn) for txn in cheaper]),
+                         ('add_transactions', lambda core: core.mempool.add_transactions(cheaper))]:
+        core = make_core(f'{name}-conflicts', transactions)
+        core.mempool.add_transactions(transactions)
+        start = time.perf_counter()
+        assert not any(reject(core))
+        elapsed = time.perf_counter() - start
+        print(f"{name + ' conflicts':>34} {elapsed * 1000:>9.1f} ms {TRANSACTIONS / elapsed:>10,.0f} rejections/s")
+
+    # spends that pay more fees replace the reserved ones, the first
+    # transaction of a batch wins over a later one spending the same input
+    bids = respend(transactions[:10], 3 * TRANSACTIONS, 2.0)
+    outbid = respend(transactions[:10], 4 * TRANSACTIONS, 3.0)
+    assert core.mempool.add_transactions(bids + outbid) == [True] * 10 + [False] * 10
+    assert core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0] == TRANSACTIONS
+    assert all(core.utxo_set.fetch_by_uid(txn.utxos[0].uid).spender_transaction_uid == txn.uid
+               for txn in bids)
+    assert core.mempool.add_transactions(outbid) == [True] * 10
@@ -0,0 +1,69 @@
+"""Serving historical blocks to peers, as SyncServer does with the binary
+wire format: blocks reassembled from the database tables and re-encoded,
+against the bytes of block files. Also the cost of adding the blocks.
+
+Run with: python -m scripts.bench_block_files
+"""
+import pathlib
+import random
+import tempfile
+import time
+
+from sanchain.models import Account, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+from scripts.bench_add_block import make_block, uids
+
+
+BLOCKS = 300
+TRANSACTIONS_PER_BLOCK = 100
+LOOKUPS = 200
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+    funding = [
+        UTXO(next(uids), sender.verification_key, 1e9, i, b'', 0, -1)
+        for i in range(TRANSACTIONS_PER_BLOCK)
+    ]
+
+    cores = {
+        'tables': SanchainCore.new('tables'),
+        'block files': SanchainCore.new('files', block_files=True),
+    }
+    added = dict.fromkeys(cores, 0.0)
+    for core in cores.values():
+        for utxo in funding:
+            core.utxo_set.add_utxo(utxo)
+    spendable = funding
+    for _ in range(BLOCKS):
+        block = make_block(cores['tables'], spendable, sender, receiver)
+        for name, core in cores.items():
+            start = time.perf_counter()
+            core.add_block(block)
+            added[name] += time.perf_counter() - start
+        spendable = [txn.nascent_utxos[-1] for txn in block.transactions[:-1]]
+
+    heights = random.sample(range(BLOCKS), LOOKUPS)
+    for idx in heights:
+        blocks = [core.get_block(idx) for core in cores.values()]
+        assert len({block.hash for block in blocks}) == 1
+        assert len({tuple(txn.hash for txn in block.transactions) for block in blocks}) == 1
+
+    print(f"{BLOCKS} blocks of {TRANSACTIONS_PER_BLOCK + 1} transactions, ms per block")
+    print(f"{'':>12} {'add_block':>10} {'get_raw_block':>14} {'get_block':>10}")
+    for name, core in cores.items():
+        raw = timed(core.get_raw_block, heights)
+        decoded = timed(core.get_block, heights)
+        print(f"{name:>12} {added[name] / BLOCKS * 1000:>10.2f} {raw * 1000:>14.3f} {decoded * 1000:>10.3f}")
+    print(f"database size: {cores['tables'].path.stat().st_size / 1024 / 1024:.1f} MiB (tables), "
+          f"{cores['block files'].path.stat().st_size / 1024 / 1024:.1f} MiB (block files) + "
+          f"{sum(path.stat().st_size for path in cores['block files'].block_files.folder.iterdir()) / 1024 / 1024:.1f} MiB of block files")
@@ -0,0 +1,68 @@
+"""Block store lookups of SanchainCore: a block by height or by hash and
+a transaction by hash, with and without the hash indexes.
+
+Run with: python -m scripts.bench_block_store
+"""
+import pathlib
+import random
+import tempfile
+import time
+
+from sanchain.models import Account, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+from scripts.bench_add_block import make_block, uids
+
+
+BLOCKS = 500
+TRANSACTIONS_PER_BLOCK = 100
+LOOKUPS = 200
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    for item in items:
+        assert function(item) is not None
+    return (time.perf_counter() - start) / len(items)
+
+
+def measure(core: SanchainCore, blocks: list[tuple[int, bytes]], transactions: list[bytes]):
+    return [
+        timed(core.get_block, [idx for idx, _ in blocks]),
+        timed(core.get_block_by_hash, [hash for _, hash in blocks]),
+        timed(core.get_transaction, transactions),
+    ]
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+
+    core = SanchainCore.new('bench')
+    spendable = [
+        UTXO(next(uids), sender.verification_key, 1e9, i, b'', 0, -1)
+        for i in range(TRANSACTIONS_PER_BLOCK)
+    ]
+    for utxo in spendable:
+        core.utxo_set.add_utxo(utxo)
+    for _ in range(BLOCKS):
+        block = make_block(core, spendable, sender, receiver)
+        core.add_block(block)
+        spendable = [txn.nascent_utxos[-1] for txn in block.transactions[:-1]]
+
+    rows = core.storage.fetchall("SELECT idx, hash FROM blocks")
+    blocks = random.sample(rows, LOOKUPS)
+    transactions = [row[0] for row in random.sample(
+        core.storage.fetchall("SELECT hash FROM transactions"), LOOKUPS)]
+
+    indexed = measure(core, blocks, transactions)
+    with core.storage.transaction() as conn:
+        conn.execute("DROP INDEX blocks_hash")
+        conn.execute("DROP INDEX transactions_hash")
+    scanned = measure(core, blocks, transactions)
+
+    print(f"{BLOCKS} blocks of {TRANSACTIONS_PER_BLOCK + 1} transactions, ms per lookup")
+    print(f"{'':>20} {'indexed':>9} {'no index':>9}")
+    for name, with_index, without_index in zip(
+            ['block by height', 'block by hash', 'transaction by hash'], indexed, scanned):
+        print(f"{name:>20} {with_index * 1000:>9.3f} {without_index * 1000:>9.3f}")
@@ -0,0 +1,52 @@
+"""Cost of encoding transactions for signatures and hashes: signing,
+re-verifying the same transaction objects with a warm signature cache (as
+Block.validate does after the Pipeline verified the transactions) and
+mining a block of already verified transactions.
+
+Run with: python -m scripts.bench_canonical
+"""
+import time
+
+from sanchain.models import Account, Block, BlockReward, Transaction, UTXO
+from sanchain.config import SanchainConfig
+
+
+COUNT = 2_000
+SENDERS = 50
+BLOCK_SIZE = 100
+ROUNDS = 10
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+if __name__ == "__main__":
+    config = SanchainConfig.default('bench')
+    config.difficulty = 1
+    miner = Account.new()
+    senders = [Account.new() for _ in range(SENDERS)]
+    transactions = []
+    for i in range(COUNT):
+        sender = senders[i % SENDERS]
+        utxo = UTXO(i, sender.verification_key, 10.0, 0, bytes(32), 0, -1)
+        transactions.append(Transaction(
+            i, sender.public_key, miner.public_key, 1.0, [utxo], b'', [], b'', -1))
+
+    signing = timed(lambda txn: txn.sign(senders[txn.uid % SENDERS].private_key), transactions)
+    Transaction.verify_many(transactions, config)  # fills the signature cache
+    verifying = timed(lambda txn: Transaction.verify_many([txn], config), transactions)
+
+    def mine(i):
+        block = Block.new(transactions[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE], config)
+        block.mine(miner.public_key)
+    mining = timed(mine, range(ROUNDS))
+    reward = timed(lambda _: BlockReward.new(miner.public_key, config), range(ROUNDS))
+
+    print(f"{'sign':>24} {signing * 1e6:>10.1f} us/transaction")
+    print(f"{'verify again (cached)':>24} {verifying * 1e6:>10.1f} us/transaction")
+    print(f"{'BlockReward.new':>24} {reward * 1e6:>10.1f} us")
+    print(f"{f'mine {BLOCK_SIZE} transactions':>24} {mining * 1000:>10.2f} ms")
@@ -0,0 +1,47 @@
+"""Per-transaction cost of the work that depends on public key encodings:
+reading mempool rows, writing rows, JSON encoding, verification with a warm
+signature cache and execution.
+
+Run with: python -m scripts.bench_keys
+"""
+import time
+
+from sanchain.models import Account, Transaction, UTXO
+from sanchain.config import SanchainConfig
+
+
+COUNT = 5_000
+SENDERS = 50
+
+
+def timed(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return (time.perf_counter() - start) / len(items)
+
+
+if __name__ == "__main__":
+    config = SanchainConfig.default('bench')
+    miner = Account.new()
+    senders = [Account.new() for _ in range(SENDERS)]
+    transactions = []
+    for i in range(COUNT):
+        sender = senders[i % SENDERS]
+        utxo = UTXO(i, sender.verification_key, 10.0, 0, b'', 0, -1)
+        txn = Transaction(i, sender.public_key, miner.public_key, 1.0, [utxo], b'', [], b'', -1)
+        txn.sign(sender.private_key)
+        transactions.append(txn)
+    rows = [list(txn.to_db_row()) + [txn.utxos, []] for txn in transactions]
+    Transaction.verify_many(transactions, config)  # fills the signature cache
+
+    results = [
+        ('from_db_row', timed(Transaction.from_db_row, rows)),
+        ('to_db_row', timed(Transaction.to_db_row, transactions)),
+        ('to_json', timed(Transaction.to_json, transactions)),
+        ('verify (cached)', timed(lambda txn: Transaction.verify_many([txn], config), transactions)),
+        ('execute', timed(lambda txn: txn.execute(miner.public_key, config), transactions)),
+    ]
+    print(f"{'':>16} {'us/transaction':>15}")
+    for name, elapsed in results:
+        print(f"{name:>16} {elapsed * 1e6:>15.1f}")
@@ -0,0 +1,71 @@
+"""Block template build time (Mempool.read_transactions) against UTXO set size.
+
+Run with: python -m scripts.bench_mempool
+"""
+import pathlib
+import sqlite3
+import tempfile
+import time
+
+from sanchain.models import Account, Transaction, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+
+
+UTXO_SET_SIZES = [1_000, 10_000, 100_000]
+MEMPOOL_SIZE = 100
+INPUTS_PER_TRANSACTION = 2
+ROUNDS = 20
+
+
+def populate(core: SanchainCore, size: int, sender: Account, receiver: Account):
+    utxos = [
+        UTXO(i, sender.verification_key, 10.0, 0, i.to_bytes(32, 'little'), 0, -1)
+        for i in range(size)
+    ]
+    with sqlite3.connect(core.path) as conn:
+        conn.executemany(
+            f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+            [utxo.to_db_row() for utxo in utxos]
+        )
+
+    for i in range(MEMPOOL_SIZE):
+        inputs = utxos[i * INPUTS_PER_TRANSACTION:(i + 1) * INPUTS_PER_TRANSACTION]
+        txn = Transaction(size + i, sender.public_key, receiver.public_key,
+                          1.0, inputs, b'', [], b'', -1)
+        core.mempool.add_transaction(txn)
+
+
+def measure(core: SanchainCore):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        txns = core.mempool.read_transactions(MEMPOOL_SIZE)
+    assert len(txns) == MEMPOOL_SIZE
+    assert all(len(txn.utxos) == INPUTS_PER_TRANSACTION for txn in txns)
+    return (time.perf_counter() - start) / ROUNDS
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+
+    print(f"{'utxos':>10} {'indexed (ms)':>14} {'no index (ms)':>14}")
+    for size in UTXO_SET_SIZES:
+        core = SanchainCore.new(f'bench-{size}')
+        populate(core, size, sender, receiver)
+        indexed = measure(core)
+
+        with sqlite3.connect(core.path) as conn:
+            conn.execute("DROP INDEX utxos_spender")
+            conn.execute("DROP INDEX utxos_transaction_hash")
+        unindexed = measure(core)
+
+        print(f"{size:>10} {indexed * 1000:>14.2f} {unindexed * 1000:>14.2f}")
+
+    # a transaction that leaves the mempool and is offered again is picked once
+    txn = core.mempool.read_transactions(1)[0]
+    core.mempool.remove_transaction(txn)
+    core.free_transaction_utxos(txn)
+    assert core.mempool.add_transaction(txn)
+    uids = [txn.uid for txn in core.mempool.read_transactions()]
+    assert len(uids) == len(set(uids)) == MEMPOOL_SIZE
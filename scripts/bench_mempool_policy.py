@@ -0,0 +1,98 @@
+"""Mempool growth under a stream of transactions: block template build time
+(Mempool.read_transactions) without effective limits and with a capped
+mempool that evicts the lowest fee density, then the cost of an
+incremental expiry sweep.
+
+Run with: python -m scripts.bench_mempool_policy
+"""
+import pathlib
+import random
+import sqlite3
+import tempfile
+import time
+
+from sanchain.models import Account, Transaction, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+
+
+TRANSACTIONS = 20_000
+CAP = 2_000
+ROUNDS = 10
+
+
+def make_core(name: str, sender: Account, receiver: Account):
+    core = SanchainCore.new(name)
+    utxos = [
+        UTXO(i, sender.verification_key, 100.0, 0, i.to_bytes(32, 'little'), 0, -1)
+        for i in range(TRANSACTIONS)
+    ]
+    with sqlite3.connect(core.path) as conn:
+        conn.executemany(
+            f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+            [utxo.to_db_row() for utxo in utxos]
+        )
+    transactions = [
+        Transaction(TRANSACTIONS + i, sender.public_key, receiver.public_key,
+                    random.uniform(1.0, 50.0), [utxo], b'', [], b'', -1)
+        for i, utxo in enumerate(utxos)
+    ]
+    return core, transactions
+
+
+def fill(core: SanchainCore, transactions: list[Transaction]):
+    start = time.perf_counter()
+    admitted = sum(core.mempool.add_transaction(txn) for txn in transactions)
+    return admitted, time.perf_counter() - start
+
+
+def read(core: SanchainCore):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        core.mempool.read_transactions()
+    return (time.perf_counter() - start) / ROUNDS
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+
+    print(f"{TRANSACTIONS} transactions offered")
+    print(f"{'':>10} {'admitted':>9} {'in mempool':>11} {'admission (ms)':>15} {'read (ms)':>10}")
+    for name, cap in [('unbounded', TRANSACTIONS), ('capped', CAP)]:
+        core, transactions = make_core(name, sender, receiver)
+        core.mempool.policy.max_transactions = cap
+        admitted, elapsed = fill(core, transactions)
+        size = core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0]
+        print(f"{name:>10} {admitted:>9} {size:>11} {elapsed * 1000:>15.1f} {read(core) * 1000:>10.2f}")
+
+    # the capped mempool holds the highest fee densities
+    kept = sorted(txn.amount for txn in transactions if txn.uid in core.mempool.template)
+    assert len(kept) == CAP
+    assert kept[0] >= sorted(txn.amount for txn in transactions)[-CAP] - 1e-9
+
+    # an evicted transaction that is admitted again, twice, counts once
+    # when the mempool is brought back within its limits
+    evicted = min(transactions, key=lambda txn: txn.amount)
+    assert evicted.uid not in core.mempool.template
+    core.mempool.policy.max_transactions = CAP + 1
+    assert core.mempool.add_transaction(evicted)
+    core.mempool.remove_transaction(evicted)
+    core.free_transaction_utxos(evicted)
+    assert core.mempool.add_transaction(evicted)
+    core.mempool.policy.max_transactions = CAP - 1
+    core.mempool.sweep()
+    assert len(core.mempool.template) == CAP - 1
+    assert core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0] == CAP - 1
+
+    # every transaction expires, the sweep removes a bounded number at a time
+    core.mempool.policy.expiry = 0
+    sweeps = []
+    while len(core.mempool.template):
+        start = time.perf_counter()
+        core.mempool.sweep(500)
+        sweeps.append(time.perf_counter() - start)
+    assert core.get_reserved_balance(sender.verification_key) == 0
+    assert core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0] == 0
+    print(f"expiry: {len(sweeps)} sweeps of up to 500 transactions, "
+          f"{max(sweeps) * 1000:.1f} ms at most, reserved UTXOs freed")
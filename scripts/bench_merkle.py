@@ -0,0 +1,63 @@
+"""Merkle root after one transaction of a candidate block changes: rebuilding
+the tree from scratch, as Block.__calculate_merkle_root used to, against
+updating a MerkleTree. Also the size and check time of inclusion proofs.
+
+Run with: python -m scripts.bench_merkle
+"""
+import os
+import time
+
+import rsa
+
+from sanchain.models import MerkleTree
+
+
+SIZES = [100, 1_000, 10_000]
+ROUNDS = 200
+
+
+def rebuild(nodes: list[bytes]):
+    """The merkle root before MerkleTree."""
+    while len(nodes) > 1:
+        new_nodes = []
+        for i in range(0, len(nodes), 2):
+            try:
+                new_nodes.append(rsa.compute_hash(nodes[i] + nodes[i + 1], 'SHA-256'))
+            except IndexError:
+                new_nodes.append(rsa.compute_hash(nodes[i], 'SHA-256'))
+        nodes = new_nodes
+    return nodes[-1]
+
+
+def timed(function, rounds: int = ROUNDS):
+    start = time.perf_counter()
+    for i in range(rounds):
+        function(i)
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    print(f"{'leaves':>8} {'rebuild (ms)':>13} {'replace (us)':>13} {'append (us)':>12} "
+          f"{'proof (us)':>11} {'verify (us)':>12} {'proof bytes':>12}")
+    for size in SIZES:
+        leaves = [os.urandom(32) for _ in range(size)]
+        replacements = [os.urandom(32) for _ in range(ROUNDS)]
+        tree = MerkleTree(leaves)
+
+        def replace_and_rebuild(i):
+            leaves[i % size] = replacements[i]
+            rebuild(leaves)
+
+        rebuilt = timed(replace_and_rebuild, max(1, ROUNDS * 100 // size))
+        replaced = timed(lambda i: tree.replace(i % size, replacements[i]))
+        assert tree.root == rebuild(tree.leaves)
+        appended = timed(lambda i: tree.append(replacements[i]))
+        assert tree.root == rebuild(tree.leaves)
+
+        proofs = [tree.proof(i) for i in range(ROUNDS)]
+        proved = timed(lambda i: tree.proof(i))
+        verified = timed(lambda i: MerkleTree.verify(tree.leaves[i], proofs[i], tree.root))
+        proof_bytes = sum(32 for sibling, _ in proofs[0] if sibling is not None)
+
+        print(f"{size:>8} {rebuilt * 1000:>13.2f} {replaced * 1e6:>13.1f} {appended * 1e6:>12.1f} "
+              f"{proved * 1e6:>11.1f} {verified * 1e6:>12.1f} {proof_bytes:>12}")
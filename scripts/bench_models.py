@@ -0,0 +1,66 @@
+"""Memory per object and construction throughput of UTXO and Transaction,
+as built by UTXOSet.fetch_by_owner and Mempool.read_transactions, and of
+the same UTXOs in a columnar UTXOBatch.
+
+Run with: python -m scripts.bench_models
+"""
+import gc
+import os
+import sqlite3
+import time
+import tracemalloc
+
+from sanchain.models import Account, Transaction, UTXO, UTXOBatch
+
+
+COUNT = 100_000
+
+
+def measure(build, count: int = COUNT):
+    """Returns (bytes per object, objects per second) of build()."""
+    gc.collect()
+    start = time.perf_counter()
+    objects = build()
+    elapsed = time.perf_counter() - start
+    assert len(objects) == count
+    del objects
+
+    gc.collect()
+    tracemalloc.start()
+    objects = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / count, count / elapsed
+
+
+if __name__ == "__main__":
+    owner = Account.new()
+    receiver = Account.new()
+    rows = [
+        (i, owner.verification_key, 10.0, i % 3, os.urandom(32), i // 100, -1)
+        for i in range(COUNT)
+    ]
+    utxos = [UTXO.from_db_row(row) for row in rows]
+
+    # the bytes values of rows read from SQLite are not shared between UTXOs
+    conn = sqlite3.connect(':memory:')
+    conn.execute(f"CREATE TABLE utxos ({', '.join([f'{column[0]} {column[1]}' for column in UTXO.db_columns])})")
+    conn.executemany("INSERT INTO utxos VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def fetch():
+        return conn.execute("SELECT * FROM utxos")
+
+    print(f"{'':>22} {'bytes/object':>13} {'objects/s':>11}")
+    size, rate = measure(lambda: [UTXO.from_db_row(row) for row in fetch()])
+    print(f"{'UTXO.from_db_row':>22} {size:>13.0f} {rate:>11,.0f}")
+
+    size, rate = measure(lambda: [
+        Transaction(i, owner.public_key, receiver.public_key, 1.0, utxos[i:i + 1], b'', [], b'', -1)
+        for i in range(COUNT)])
+    print(f"{'Transaction()':>22} {size:>13.0f} {rate:>11,.0f}")
+
+    size, rate = measure(lambda: UTXOBatch.from_rows(fetch()))
+    print(f"{'UTXOBatch.from_rows':>22} {size:>13.0f} {rate:>11,.0f}")
+
+    batch = UTXOBatch.from_rows(rows)
+    assert list(batch.rows()) == rows
@@ -0,0 +1,111 @@
+"""Processing of incoming transaction messages: handled inline on the event
+loop, as Client.listen_and_record used to, against the staged Pipeline with
+and without a process pool for signature checks. Besides throughput, the
+stalls of the event loop (99th percentile and longest) show how long
+socket reads would wait.
+
+Run with: python -m scripts.bench_pipeline
+"""
+import asyncio
+import json
+import pathlib
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sanchain.models import Account, Transaction, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+from sanchain.broadcast.message import MessageHandler as MH
+from sanchain.broadcast.pipeline import Pipeline
+
+
+MESSAGES = 2000
+WORKERS = 4
+
+
+def make_messages(sender: Account, receiver: Account):
+    messages = []
+    for i in range(MESSAGES):
+        utxo = UTXO(i, sender.verification_key, 10.0, 0, i.to_bytes(32, 'little'), 0, -1)
+        txn = Transaction(i, sender.public_key, receiver.public_key, 1.0, [utxo], b'', [], b'', -1)
+        txn.sign(sender.private_key)
+        messages.append(json.dumps(txn.to_json()))
+    return messages
+
+
+def make_core(name: str, messages: list):
+    core = SanchainCore.new(name)
+    with sqlite3.connect(core.path) as conn:
+        conn.executemany(
+            f"INSERT INTO utxos VALUES ({', '.join(['?' for _ in range(len(UTXO.db_columns))])})",
+            [UTXO.from_json(json.loads(message)['utxos'][0]).to_db_row() for message in messages]
+        )
+    return core
+
+
+async def watch_loop(stalls: list):
+    """Records how late the event loop runs this task after each 1 ms sleep."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+
+async def inline(core: SanchainCore, messages: list):
+    for message in messages:
+        if MH.validate_message(message):
+            obj = MH.revert(message)
+            if obj.verify(core.config):
+                core.mempool.add_transaction(obj)
+        await asyncio.sleep(0)  # the next socket read
+
+
+async def pipelined(core: SanchainCore, messages: list, executor=None):
+    pipeline = Pipeline(core, executor, verbose=False)
+    pipeline.start()
+    for message in messages:
+        await pipeline.put(message)
+    await pipeline.join()
+    await pipeline.stop()
+    return pipeline.stats()
+
+
+async def measure(name: str, process, messages: list, *args):
+    Transaction.signature_cache.clear()
+    core = make_core(name, messages)
+    stalls = []
+    watcher = asyncio.create_task(watch_loop(stalls))
+    start = time.perf_counter()
+    stats = await process(core, messages, *args)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    count = core.storage.fetchone("SELECT COUNT(*) FROM mempool")[0]
+    assert count == len(messages), count
+    core.close()
+    stalls.sort()
+    print(f"{name:>18} {len(messages) / elapsed:>12,.0f} "
+          f"{stalls[int(len(stalls) * 0.99)] * 1000:>16.1f} {stalls[-1] * 1000:>16.1f}")
+    return stats
+
+
+async def main():
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    messages = make_messages(Account.new(), Account.new())
+
+    print(f"{'':>18} {'messages/s':>12} {'p99 stall (ms)':>16} {'max stall (ms)':>16}")
+    await measure('inline', inline, messages)
+    await measure('pipeline', pipelined, messages)
+    with ProcessPoolExecutor(WORKERS) as executor:
+        stats = await measure(f'pipeline+{WORKERS} procs', pipelined, messages, executor)
+
+    print()
+    print(f"{'stage':>8} {'processed':>10} {'per second':>11} {'utilization':>12} {'max queue':>10}")
+    for stage, stage_stats in stats.items():
+        print(f"{stage:>8} {stage_stats['processed']:>10} {stage_stats['throughput']:>11,.0f} "
+              f"{stage_stats['utilization']:>12.0%} {stage_stats['max_queue_depth']:>10}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
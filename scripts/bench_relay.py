@@ -0,0 +1,163 @@
+"""Load test of the relay host: delivered messages per second, delivery
+latency and bytes received by the clients with many connected clients on
+loopback. The old handler, which awaited every client in turn and pushed
+every message to everyone, is included for comparison, as is a relay that
+announces every object, however small, with an inv. In the 'redundant'
+run every message is submitted by several senders, as when a transaction
+reaches the relay through several nodes. In the 'two relays' run every
+client and sender is connected to two relays, and a client doesn't request
+the objects it already has from the other one.
+
+Run with: python -m scripts.bench_relay
+"""
+import asyncio
+import json
+import time
+
+import websockets
+
+from sanchain.broadcast.host import Relay
+from sanchain.broadcast.inventory import INV, getdata, inventory_id, parse_control
+
+
+HOST = "127.0.0.1"
+TIME_LIMIT = 20  # seconds before a run counts as stalled
+
+# name, clients, messages, payload bytes, messages per second (0 = burst),
+# stalled clients, senders per message, relays
+RUNS = [
+    ('burst', 300, 200, 2048, 0, 0, 1, 1),
+    ('paced', 300, 200, 2048, 50, 0, 1, 1),
+    ('stalled', 50, 200, 32 * 1024, 50, 1, 1, 1),
+    ('redundant', 100, 200, 2048, 50, 0, 4, 1),
+    ('two relays', 50, 100, 32 * 1024, 50, 0, 1, 2),
+]
+
+
+def sequential():
+    """The relay loop before it was made concurrent."""
+    clients = []
+
+    async def handler(websocket, path=None):
+        clients.append(websocket)
+        try:
+            async for message in websocket:
+                for client in clients:
+                    await client.send(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            clients.remove(websocket)
+
+    return handler
+
+
+async def receive(connections: list, latencies: list, received: list, messages: int):
+    """Reads the messages of one client from every relay it is connected to.
+    Announced objects that the client has or has requested are not requested."""
+    seen = set()
+    ids = set()  # inventory ids received or requested
+    done = asyncio.Event()
+
+    async def read(connection):
+        while True:
+            message = await connection.recv()
+            received[0] += len(message)
+            control = parse_control(message)
+            if control is not None:
+                missing = [id for id in control[1] if id not in ids]
+                if control[0] == INV and missing:
+                    ids.update(missing)
+                    await connection.send(getdata(missing))
+                continue
+            ids.add(inventory_id(message))
+            message = json.loads(message)
+            if message['seq'] in seen:
+                continue
+            seen.add(message['seq'])
+            latencies.append(time.perf_counter() - message['sent'])
+            if message['seq'] == messages - 1:
+                done.set()
+
+    readers = [asyncio.create_task(read(connection)) for connection in connections]
+    try:
+        await done.wait()
+    finally:
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+
+async def run(handler, clients: int, messages: int, payload: int, rate: int, stalled: int,
+              redundancy: int, relays: int):
+    """`handler` makes the connection handler of each relay."""
+    # no compression, the test payload would shrink to nothing
+    servers = [await websockets.serve(handler(), HOST, 0, max_queue=None, compression=None)
+               for _ in range(relays)]
+    uris = [f"ws://{HOST}:{server.sockets[0].getsockname()[1]}" for server in servers]
+
+    async def connect_all(**options):
+        return [await websockets.connect(uri, **options) for uri in uris]
+
+    senders = [await connect_all(max_queue=None) for _ in range(redundancy)]
+    receivers = [await connect_all(max_queue=None) for _ in range(clients)]
+    sleepers = [await websockets.connect(uris[0]) for _ in range(stalled)]
+    for connection in sleepers:
+        # never read from, so their socket buffers fill up
+        connection.transport.pause_reading()
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    received = [0]
+    listeners = asyncio.gather(*[
+        receive(connections, latencies, received, messages) for connections in receivers])
+
+    start = time.perf_counter()
+    for seq in range(messages):
+        message = json.dumps(
+            {'seq': seq, 'sent': time.perf_counter(), 'payload': 'x' * payload})
+        for connections in senders:
+            for sender in connections:
+                await sender.send(message)
+        await asyncio.sleep(1 / rate if rate else 0)
+    try:
+        await asyncio.wait_for(listeners, TIME_LIMIT)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - start
+
+    for connection in sum(receivers + senders, []) + sleepers:
+        connection.transport.abort()
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+    latencies.sort()
+    complete = len(latencies) == clients * messages
+    return (
+        len(latencies) / elapsed,
+        latencies[len(latencies) // 2] if latencies else float('nan'),
+        latencies[int(len(latencies) * 0.99)] if latencies else float('nan'),
+        received[0] / clients,
+        complete,
+    )
+
+
+async def main():
+    print(f"{'relay':>12} {'run':>10} {'clients':>8} {'deliveries/s':>13} "
+          f"{'p50 (ms)':>9} {'p99 (ms)':>9} {'KiB/client':>11}")
+    handlers = (
+        ('sequential', sequential),
+        ('inv only', lambda: Relay(announce_size=0, verbose=False).handler),
+        ('inventory', lambda: Relay(verbose=False).handler),
+    )
+    for name, handler in handlers:
+        for run_name, *params in RUNS:
+            deliveries, p50, p99, received, complete = await run(handler, *params)
+            print(f"{name:>12} {run_name:>10} {params[0]:>8} {deliveries:>13,.0f} "
+                  f"{p50 * 1000:>9.1f} {p99 * 1000:>9.1f} {received / 1024:>11,.0f}"
+                  f"{'' if complete else '  (incomplete)'}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""Bootstrap of a new core: replaying every block through
+SanchainCore.add_block against loading a UTXO snapshot.
+
+Run with: python -m scripts.bench_snapshot
+"""
+import pathlib
+import tempfile
+import time
+
+from sanchain.models import Account, UTXO
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+from scripts.bench_add_block import make_block, uids
+
+
+BLOCKS = 1000
+TRANSACTIONS_PER_BLOCK = 100
+
+
+def utxo_rows(core: SanchainCore):
+    core.utxo_set.flush()
+    return core.storage.fetchall(
+        "SELECT uid, verification_key, value, idx, transaction_hash, block_index FROM utxos ORDER BY uid")
+
+
+if __name__ == "__main__":
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    sender, receiver = Account.new(), Account.new()
+
+    funding = [
+        UTXO(next(uids), sender.verification_key, 1e9, i, b'', 0, -1)
+        for i in range(TRANSACTIONS_PER_BLOCK)
+    ]
+    source = SanchainCore.new('source')
+    for utxo in funding:
+        source.utxo_set.add_utxo(utxo)
+    spendable = funding
+    for _ in range(BLOCKS):
+        block = make_block(source, spendable, sender, receiver)
+        source.add_block(block)
+        spendable = [txn.nascent_utxos[-1] for txn in block.transactions[:-1]]
+    blocks = [source.get_block(idx) for idx in range(BLOCKS)]
+
+    replayed = SanchainCore.new('replay')
+    for utxo in funding:
+        replayed.utxo_set.add_utxo(utxo)
+    start = time.perf_counter()
+    for block in blocks:
+        replayed.add_block(block)
+    replay = time.perf_counter() - start
+
+    path = SanchainConfig.DB_FOLDER / 'utxos.snapshot'
+    start = time.perf_counter()
+    count = source.export_snapshot(path)
+    export = time.perf_counter() - start
+
+    restored = SanchainCore.new('restore')
+    start = time.perf_counter()
+    restored.load_snapshot(path)
+    restore = time.perf_counter() - start
+
+    assert utxo_rows(restored) == utxo_rows(source) == utxo_rows(replayed)
+    assert restored.config.to_db_row() == source.config.to_db_row()
+
+    print(f"{BLOCKS} blocks of {TRANSACTIONS_PER_BLOCK + 1} transactions, {count:,} UTXOs, "
+          f"snapshot {path.stat().st_size / 1024 / 1024:.1f} MiB")
+    print(f"replay:   {replay:8.2f} s")
+    print(f"export:   {export:8.2f} s")
+    print(f"restore:  {restore:8.2f} s ({replay / restore:.0f}x faster than replay)")
@@ -0,0 +1,219 @@
+"""Header-first sync of a fresh core from stand-in peers on loopback, with
+one peer and with several, and with a simulated round trip time per
+request. The peers serve copies of a chain mined at difficulty 1. Each sync
+is checked against the source: same tip, same UTXO set. Last, one peer
+disconnects in the middle of its first range after the other peer has
+downloaded everything else, and the sync must still complete. Then peers
+that tamper with the blocks they send, and a peer that lags behind and has
+no new headers, must not stop the sync either.
+
+Run with: python -m scripts.bench_sync
+"""
+import asyncio
+import itertools
+import json
+import pathlib
+import shutil
+import tempfile
+import time
+
+import websockets
+
+import sanchain.models.block
+import sanchain.models.transaction
+import sanchain.models.utxo
+from sanchain.models import Account, Transaction
+from sanchain.core import SanchainCore
+from sanchain.config import SanchainConfig
+from sanchain.broadcast.sync import GETBLOCKS, GETHEADERS, HEADERS, NOTFOUND, ChainSync, SyncServer
+
+
+HOST = "127.0.0.1"
+BLOCKS = 200
+TRANSACTIONS_PER_BLOCK = 20
+PEERS = [1, 4]
+LATENCIES = [0, 0.05]  # seconds added to every request
+DIFFICULTY = 1
+
+# utils.uid is only unique per call, not per burst of calls
+uids = itertools.count(1)
+for module in (sanchain.models.block, sanchain.models.transaction, sanchain.models.utxo):
+    module.uid = lambda: next(uids)
+
+
+class SlowServer(SyncServer):
+    def __init__(self, core: SanchainCore, latency: float) -> None:
+        super().__init__(core)
+        self.latency = latency
+
+    async def handler(self, websocket, path=None):
+        async def delayed():
+            async for message in websocket:
+                await asyncio.sleep(self.latency)
+                yield message
+
+        class Connection:
+            """Passes the delayed requests to SyncServer.handler."""
+            def __aiter__(self):
+                return delayed()
+
+            async def send(self, message):
+                await websocket.send(message)
+
+        await super().handler(Connection(), path)
+
+
+class FailingServer(SyncServer):
+    """Answers header requests, then waits `delay` seconds on the first block
+    request and disconnects after sending one block."""
+
+    def __init__(self, core: SanchainCore, delay: float) -> None:
+        super().__init__(core)
+        self.delay = delay
+
+    async def handler(self, websocket, path=None):
+        async def requests():
+            async for message in websocket:
+                request = json.loads(message)
+                if request['type'] == GETBLOCKS:
+                    await asyncio.sleep(self.delay)
+                    await websocket.send(self.get_block_message(request['start']))
+                    await websocket.close()
+                    return
+                yield message
+
+        class Connection:
+            def __aiter__(self):
+                return requests()
+
+            async def send(self, message):
+                await websocket.send(message)
+
+        await super().handler(Connection(), path)
+
+
+class TamperingServer(SyncServer):
+    """Sends blocks that keep their hash field but not their content:
+    a changed timestamp, which the header covers, or a changed output
+    value, which only SanchainCore.receive_block notices."""
+
+    def __init__(self, core: SanchainCore, field: str) -> None:
+        super().__init__(core)
+        self.field = field
+
+    def get_block_message(self, idx: int):
+        block = self.core.get_block(idx)
+        if self.field == 'timestamp':
+            block.timestamp += 1
+        else:
+            block.transactions[-1].nascent_utxos[0].value += 1
+        return self.mh.convert(block)
+
+
+class LaggingServer(SyncServer):
+    """Has no block beyond the ones of the syncing node."""
+
+    async def handler(self, websocket, path=None):
+        async for message in websocket:
+            request = json.loads(message)
+            if request['type'] == GETHEADERS:
+                await websocket.send(json.dumps({'type': HEADERS, 'headers': []}))
+            else:
+                for _ in range(request['count']):
+                    await websocket.send(NOTFOUND)
+
+
+def new_core(uid: str):
+    core = SanchainCore.new(uid)
+    core.config.difficulty = DIFFICULTY
+    return core
+
+
+def mine_chain(core: SanchainCore, accounts: list[Account]):
+    """Mines BLOCKS blocks in which the accounts send each other half of their UTXOs."""
+    owners = {account.verification_key: account for account in accounts}
+    for _ in range(BLOCKS):
+        spendable = [utxo for account in accounts
+                     for utxo in core.utxo_set.fetch_by_owner(account.verification_key, unused=True)]
+        for utxo in spendable[:TRANSACTIONS_PER_BLOCK]:
+            sender = owners[utxo.verification_key]
+            receiver = accounts[0] if sender is accounts[1] else accounts[1]
+            txn = Transaction.unsigned(sender.public_key, receiver.public_key, utxo.value / 2, [utxo])
+            txn.sign(sender.private_key)
+            core.mempool.add_transaction(txn)
+
+        block = core.create_block()
+        block.mine(accounts[0].public_key)
+        core.add_block(block)
+        for transaction in block.transactions:
+            core.mempool.remove_transaction(transaction)
+
+
+def utxo_rows(core: SanchainCore):
+    core.utxo_set.flush()
+    return core.storage.fetchall(
+        "SELECT uid, verification_key, value, idx, transaction_hash, block_index FROM utxos ORDER BY uid")
+
+
+async def sync(source: SanchainCore, peers: int, latency: float, name: str, special: tuple = ()):
+    """The first peers are served by the `special` server factories instead of SlowServer."""
+    # every peer serves its own copy of the chain
+    servers = []
+    for i in range(peers):
+        folder = SanchainConfig.DB_FOLDER / f'{name}-peer-{i}'
+        shutil.copytree(SanchainConfig.DB_FOLDER / source.config.core_id, folder)
+        peer = SanchainCore.local(folder.name)
+        server = special[i](peer) if i < len(special) else SlowServer(peer, latency)
+        servers.append(await websockets.serve(server.handler, HOST, 0))
+    uris = [f"ws://{HOST}:{server.sockets[0].getsockname()[1]}" for server in servers]
+
+    core = new_core(name)
+    Transaction.signature_cache.clear()
+    start = time.perf_counter()
+    added = await ChainSync(core, uris).run()
+    elapsed = time.perf_counter() - start
+
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+
+    assert added == BLOCKS
+    assert core.config.last_block_hash == source.config.last_block_hash
+    assert utxo_rows(core) == utxo_rows(source)
+    return elapsed
+
+
+async def main():
+    SanchainConfig.DB_FOLDER = pathlib.Path(tempfile.mkdtemp())
+    source = new_core('source')
+    start = time.perf_counter()
+    mine_chain(source, [Account.new(), Account.new()])
+    source.close()
+    print(f"mined {BLOCKS} blocks of up to {TRANSACTIONS_PER_BLOCK + 1} transactions "
+          f"in {time.perf_counter() - start:.1f} s")
+    source = SanchainCore.local('source')
+
+    print(f"{'rtt (ms)':>9} {'peers':>6} {'sync (s)':>9} {'blocks/s':>9}")
+    for latency in LATENCIES:
+        for peers in PEERS:
+            elapsed = await sync(source, peers, latency, f'sync-{latency}-{peers}')
+            print(f"{latency * 1000:>9.0f} {peers:>6} {elapsed:>9.2f} {BLOCKS / elapsed:>9.1f}")
+
+    # the range of the failing peer is retried by the peer that has finished
+    delay = 3
+    elapsed = await asyncio.wait_for(
+        sync(source, 2, 0, 'sync-failing', (lambda core: FailingServer(core, delay),)), 60)
+    print(f"a peer failing after {delay} s: synced in {elapsed:.2f} s")
+
+    elapsed = await asyncio.wait_for(sync(source, 3, 0, 'sync-tampering', (
+        lambda core: TamperingServer(core, 'timestamp'),
+        lambda core: TamperingServer(core, 'output'),
+    )), 60)
+    print(f"two peers tampering with blocks: synced in {elapsed:.2f} s")
+
+    elapsed = await asyncio.wait_for(sync(source, 2, 0, 'sync-lagging', (LaggingServer,)), 60)
+    print(f"a peer without new headers: synced in {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""Size and encode/decode time of full blocks in the JSON and binary wire formats.
+
+Run with: python -m scripts.bench_wire
+"""
+import os
+import time
+
+from sanchain.models import Account, Block, BlockReward, Transaction, UTXO
+from sanchain.config import SanchainConfig
+from sanchain.broadcast import MessageHandler
+
+
+TRANSACTIONS = [1, 10, 100]
+ACCOUNTS = 10
+ROUNDS = 20
+
+
+def make_block(size: int, accounts: list[Account]):
+    config = SanchainConfig.default('')
+    transactions = []
+    for i in range(size):
+        sender = accounts[i % len(accounts)]
+        receiver = accounts[(i + 1) % len(accounts)]
+        utxos = [UTXO(i * 10 + j, sender.verification_key, 10.0, j, os.urandom(32), 0, -1)
+                 for j in range(2)]
+        txn = Transaction(i, sender.public_key, receiver.public_key, 5.0, utxos, b'', [], b'', -1)
+        txn.sign(sender.private_key)
+        txn.verify(config)
+        txn.execute(accounts[0].public_key, config)
+        transactions.append(txn)
+    transactions.append(BlockReward.new(accounts[0].public_key, config))
+    return Block(0, int(time.time()), os.urandom(32), config, transactions, os.urandom(32), 0)
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / ROUNDS
+
+
+if __name__ == "__main__":
+    accounts = [Account.new() for _ in range(ACCOUNTS)]
+    print(f"{'txns':>5} {'format':>7} {'bytes':>9} {'encode (ms)':>12} {'decode (ms)':>12}")
+    for size in TRANSACTIONS:
+        block = make_block(size, accounts)
+        for wire_format in MessageHandler.formats:
+            message, encode = measure(MessageHandler.convert_block, block, wire_format)
+            decoded, decode = measure(MessageHandler.revert, message)
+            assert decoded.to_json() == block.to_json()
+            print(f"{size:>5} {wire_format:>7} {len(message):>9,} {encode * 1000:>12.2f} {decode * 1000:>12.2f}")
+
+    # truncated or padded binary messages are rejected, not misread
+    message = MessageHandler.convert_block(make_block(1, accounts), 'binary')
+    for end in range(len(message)):
+        try:
+            MessageHandler.revert(message[:end])
+            raise AssertionError(f"truncated message of {end} bytes was decoded")
+        except ValueError:
+            pass
+    try:
+        MessageHandler.revert(message + b'\0')
+        raise AssertionError("padded message was decoded")
+    except ValueError:
+        pass